@@ -0,0 +1,127 @@
+"""Flag the query shapes of the bot that Mongo answers with a collection scan.
+
+Seeds a scratch database with a few documents of every model, runs
+explain() on each query the callbacks, the refresher and the broadcaster
+send, and exits with status 1 if a winning plan contains a COLLSCAN.
+
+Run from the repository root with a local mongod:
+
+    python -m benchmarks.explain_queries
+"""
+import sys
+import datetime
+from mongoengine import connect
+from mongoengine.queryset.visitor import Q
+
+DB_NAME = 'castpod_explain'
+PODCASTS = 20
+EPISODES = 50  # per podcast
+USERS = 50
+
+
+def stages(plan):
+    """All stage names of an explain() plan, in any of its nested forms."""
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from stages(value)
+
+
+def seed():
+    from castpod.models import User, Podcast, Episode, Subscription, Star, Delivery
+    models = [User, Podcast, Episode, Subscription, Star, Delivery]
+    for model in models:
+        model.drop_collection()
+        model.ensure_indexes()
+    users = [User(user_id=user_id, name=f'user {user_id}').save()
+             for user_id in range(1, USERS + 1)]
+    now = datetime.datetime.utcnow()
+    for i in range(PODCASTS):
+        podcast = Podcast(feed=f'https://example.com/{i}.xml',
+                          name=f'podcast {i}', host=f'host {i}').save()
+        episodes = [Episode(
+            from_podcast=podcast, title=f'podcast {i} #{number}', guid=f'{i}-{number}',
+            url=f'https://cdn.example.com/{i}/{number}.mp3', number=number,
+            published_time=now - datetime.timedelta(days=EPISODES - number),
+            message_id=number, is_downloaded=True)
+            for number in range(1, EPISODES + 1)]
+        Episode.objects.insert(episodes, load_bulk=False)
+        for user in users[i::3]:
+            Subscription(user=user, podcast=podcast).save()
+        for user in users[i::7]:
+            Star(user=user, podcast=podcast).save()
+    for episode in Episode.objects(number=EPISODES):
+        Delivery(user_id=1, podcast=episode.from_podcast, episode=episode, message_id=1,
+                 status='digest', due_time=now).save()
+    return users[0], Podcast.objects.first(), Episode.objects.first()
+
+
+def shapes(user, podcast, episode):
+    """(name, queryset) of every hot query, mirroring the code that sends it."""
+    from castpod.models import User, Podcast, Episode, Subscription, Star, Delivery
+    now = datetime.datetime.utcnow()
+    podcast_ids = Subscription.podcast_ids(user)
+    return [
+        ('User.validate_user', User.objects(user_id=user.user_id)),
+        ('Podcast.validate_feed', Podcast.objects(feed=podcast.feed)),
+        ('Podcast by id', Podcast.objects(id=podcast.id)),
+        ('Podcast.subscribe_by', Podcast.subscribe_by(user)),
+        ('show_subscription', Podcast.subscribe_by(
+            user).order_by('-_updated_time')),
+        ('Podcast search_text', Podcast.objects.search_text(podcast.name)),
+        ('Subscription.podcast_ids', Subscription.objects(user=user)),
+        ('Subscription.exists', Subscription.objects(user=user, podcast=podcast)),
+        ('Podcast.iter_subscribers', Subscription.objects(podcast=podcast)),
+        ('Podcast.iter_subscribers users', User.objects(
+            user_id__in=[user.user_id])),
+        ('Star.podcast_ids', Star.objects(user=user)),
+        ('Star.exists', Star.objects(user=user, podcast=podcast)),
+        ('Podcast.episode', Episode.objects(
+            from_podcast=podcast, number=EPISODES // 2)),
+        ('Podcast.episodes', podcast.episodes(10, 14)),
+        ('Podcast.episode_count', Episode.objects(
+            from_podcast=podcast).order_by('-number').limit(1)),
+        ('Podcast.new_items', Episode.objects(
+            Q(from_podcast=podcast) & (Q(guid__in=[episode.guid]) | Q(url__in=[episode.url])))),
+        ('Podcast.queue_episodes', Episode.objects(
+            from_podcast=podcast, is_downloaded=False).order_by('-published_time')),
+        ('RefreshScheduler.interval', Episode.objects(
+            from_podcast=podcast).order_by('-published_time').limit(10)),
+        ('show_episodes search', Episode.objects(
+            Q(from_podcast=podcast) & Q(title__icontains='1')).order_by('-published_time')),
+        ('share_podcast episodes', Episode.objects(
+            Q(title__icontains='1') & Q(from_podcast__in=podcast_ids))),
+        ('fav episodes', Episode.objects(starrers=user)),
+        ('Broadcaster.send_batch', Delivery.objects(
+            status='pending', due_time__lte=now).order_by('due_time').limit(100)),
+        ('Broadcaster.send_digests users', Delivery.objects(
+            status='digest', due_time__lte=now)),
+        ('Broadcaster.send_digests', Delivery.objects(
+            user_id=user.user_id, status='digest', due_time__lte=now).order_by('due_time')),
+        ('delete user: Podcast.admin', Podcast.objects(admin=user)),
+        ('delete podcast: Delivery', Delivery.objects(podcast=podcast)),
+    ]
+
+
+def main():
+    connect(db=DB_NAME)
+    user, podcast, episode = seed()
+    scans = []
+    for name, queryset in shapes(user, podcast, episode):
+        plan = queryset.explain()['queryPlanner']['winningPlan']
+        used = sorted(set(stages(plan)))
+        if 'COLLSCAN' in used:
+            scans.append(name)
+        print(f"{'SCAN' if 'COLLSCAN' in used else 'ok':<5} {name:<36} {', '.join(used)}")
+    connect(db=DB_NAME).drop_database(DB_NAME)
+    if scans:
+        print(f'\n{len(scans)} query shapes scan a whole collection.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
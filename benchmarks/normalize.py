@@ -0,0 +1,109 @@
+"""Time of deriving shownotes, timeline and summary from a corpus of show notes.
+
+Compares castpod.normalize, run once at ingest, with the regex passes of
+Episode.set_content, Episode.timeline and replace_invalid_tags it replaced.
+The corpus is every *.html file of the directory given, e.g. the content of
+real feeds saved with
+
+    python -c "import feedparser,sys; [open(f'corpus/{i}.html','w').write(e.content[0].value) for i, e in enumerate(feedparser.parse(sys.argv[1]).entries) if e.get('content')]" FEED_URL
+
+or, with no directory, show notes shaped like those of common hosts:
+timestamped lists, link lists, long prose and plain text.
+
+Run from the repository root:
+
+    python -m benchmarks.normalize [DIRECTORY]
+"""
+import re
+import sys
+import glob
+import time
+import random
+
+REPEAT = 3
+LOGO = 'https://example.com/logo.png'
+
+TOPICS = ['开场', '嘉宾介绍', 'Why we’re here', '产品设计', 'Open source', '播客的未来',
+          '读者来信', '推荐时间', 'Q&A', '结尾']
+
+
+def timestamped(rng):
+    items = ''.join(
+        f'<li><a href="https://example.com/t={minute * 60}">{minute // 60:02d}:{minute % 60:02d}:'
+        f'{rng.randrange(60):02d}</a> {rng.choice(TOPICS)}</li>'
+        for minute in sorted(rng.sample(range(120), 12)))
+    return (f'<div class="notes"><h2>本期节目</h2><p>{"这一期我们聊了很多。" * 8}</p>'
+            f'<h2>时间线</h2><ul>{items}</ul><p><span style="color:red">主播</span>：'
+            f'<cite>Host</cite></p><audio controls src="https://example.com/ep.mp3">'
+            f'Your browser does not support audio.</audio></div>')
+
+
+def link_list(rng):
+    links = ''.join(f'<p><a href="https://example.com/{i}?a=1&amp;b=2" target="_blank" rel="noopener">'
+                    f'Link {i} &mdash; {rng.choice(TOPICS)}</a></p>' for i in range(rng.randrange(5, 30)))
+    return f'<h1>Links</h1>{links}<p><img src="https://example.com/cover.jpg" alt="cover"/></p>'
+
+
+def prose(rng):
+    paragraphs = ''.join(f'<p>{"Lorem ipsum dolor sit amet, <em>consectetur</em> adipiscing elit. " * rng.randrange(3, 15)}</p>'
+                         for _ in range(rng.randrange(5, 20)))
+    return f'<div><div>{paragraphs}<p>Recorded at 12:30 on Monday.</p></div></div>'
+
+
+def plain(rng):
+    return '\n'.join(f'{minute // 60}:{minute % 60:02d} {rng.choice(TOPICS)}'
+                     for minute in sorted(rng.sample(range(90), 8))) + '\n\nThanks for listening!'
+
+
+def make_corpus(size=400):
+    rng = random.Random(0)
+    shapes = [timestamped, link_list, prose, plain]
+    return [rng.choice(shapes)(rng) for _ in range(size)]
+
+
+def load_corpus(directory):
+    corpus = []
+    for path in sorted(glob.glob(f'{directory}/*.html')):
+        with open(path, encoding='utf-8') as f:
+            corpus.append(f.read())
+    return corpus
+
+
+def regexes(shownotes):
+    """What set_content and the first access of timeline did before."""
+    img_content = f"<img src='{LOGO}'>" if 'img' not in shownotes else ''
+    html_content = shownotes.replace('h1', 'h3').replace('h2', 'h4')
+    html_content = html_content.replace('cite>', "i>")
+    html_content = re.sub(r'</?(?:div|span|audio).*?>', '', html_content)
+    html_content = html_content.replace('’', "'")
+    shownotes = img_content + html_content
+    lines = re.sub(r'</?(?:br|p|li).*?>', '\n', shownotes)
+    pattern = r'.+(?:[0-9]{1,2}[:：\'])?[0-9]{1,3}[:：\'][0-5][0-9].+'
+    timeline = '\n\n'.join([re.sub(
+        r'</?(?:cite|del|span|div|s).*?>', '', match[0].lstrip()) for match in re.finditer(pattern, lines)])
+    return shownotes, timeline
+
+
+def single_pass(shownotes):
+    from castpod.normalize import normalize
+    return normalize(shownotes, LOGO)
+
+
+def main():
+    corpus = load_corpus(sys.argv[1]) if len(sys.argv) > 1 else make_corpus()
+    size = sum(len(notes) for notes in corpus)
+    print(f'{len(corpus)} show notes, {size / 1024:.0f} KiB')
+    print(f"{'path':>12} {'s':>7} {'µs/episode':>11}")
+    for name, func in (('regexes', regexes), ('single pass', single_pass)):
+        func('')  # imports do not count
+        best = float('inf')
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            for notes in corpus:
+                func(notes)
+            best = min(best, time.perf_counter() - start)
+        print(f'{name:>12} {best:>7.3f} {best / len(corpus) * 1e6:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Peak memory and time of parsing a 5,000-outline OPML file.
+
+Compares the streaming castpod.utils.parse_opml with the BeautifulSoup
+parser it replaced. Each parser runs in a fresh process, and the peak is
+the growth of its max RSS, which also counts the memory of libxml2.
+
+Run from the repository root:
+
+    python -m benchmarks.parse_opml
+"""
+import os
+import time
+import resource
+import tempfile
+import multiprocessing
+
+OUTLINES = 5000
+GROUP = 50  # outlines per nested group
+
+
+def make_opml(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n<opml version='1.0'>"
+                "<head><title>benchmark</title></head><body>\n")
+        for group in range(OUTLINES // GROUP):
+            f.write(f'<outline text="group {group}">\n')
+            for i in range(group * GROUP, (group + 1) * GROUP):
+                f.write(f'<outline type="rss" text="播客 {i} &amp; friends" '
+                        f'xmlUrl="https://example.com/{i}/feed.xml" htmlUrl="https://example.com/{i}"/>\n')
+            f.write('</outline>\n')
+        f.write('</body></opml>\n')
+
+
+def parse_with_soup(path):
+    from bs4 import BeautifulSoup
+    feeds = []
+    with open(path, 'r') as f:
+        soup = BeautifulSoup(f, 'lxml', from_encoding="utf-8")
+        for podcast in soup.find_all(type="rss"):
+            feeds.append({"name": podcast.attrs.get('text'),
+                          "url": podcast.attrs.get('xmlurl')})
+    return len(feeds)
+
+
+def parse_streaming(path):
+    from castpod.utils import parse_opml
+    with open(path, 'rb') as f:
+        return sum(1 for _ in parse_opml(f))
+
+
+def measure(func, path, results):
+    # imported so imports do not count towards either peak
+    import bs4  # noqa: F401
+    import castpod.utils  # noqa: F401
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    count = func(path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    results.put((count, elapsed, peak))
+
+
+def main():
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.opml')
+        make_opml(path)
+        print(f"{'parser':>14} {'feeds':>6} {'s':>7} {'peak KiB':>9}")
+        for name, func in (('BeautifulSoup', parse_with_soup), ('streaming', parse_streaming)):
+            results = context.Queue()
+            process = context.Process(target=measure, args=(func, path, results))
+            process.start()
+            count, elapsed, peak = results.get()
+            process.join()
+            print(f'{name:>14} {count:>6} {elapsed:>7.3f} {peak:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Latency and allocations of the subscription list as Documents and as PodcastCards.
+
+Builds what show_subscription and ManagePage need for a user with 500
+subscriptions, once from mongoengine Documents and once from the raw
+projections of castpod.projections.
+
+Run from the repository root with a local mongod:
+
+    python -m benchmarks.read_path
+"""
+import time
+import tracemalloc
+from mongoengine import connect
+
+DB_NAME = 'castpod_benchmark'
+SUBSCRIPTIONS = 500
+REPEAT = 20
+
+
+def seed():
+    from castpod.models import User, Podcast, Logo, Subscription
+    for model in (User, Podcast, Subscription):
+        model.drop_collection()
+    user = User(user_id=1, name='benchmark').save()
+    podcasts = [Podcast(
+        feed=f'https://example.com/{i}.xml', name=f'podcast {i}', host=f'host {i}',
+        email=f'host{i}@example.com', website=f'https://example.com/{i}',
+        _logo=Logo(_path=f'public/logo/podcast {i}.jpeg', url=f'https://example.com/{i}.png',
+                   file_id=f'file-{i}' if i % 2 else None))
+        for i in range(SUBSCRIPTIONS)]
+    Podcast.objects.insert(podcasts, load_bulk=False)
+    Subscription.objects.insert([Subscription(user=user, podcast=podcast)
+                                 for podcast in Podcast.objects.only('id')], load_bulk=False)
+    return user
+
+
+def with_documents(user):
+    from castpod.models import Podcast
+    from castpod.components import ManagePage
+    ManagePage(list(Podcast.subscribe_by(user, 'name'))).keyboard()
+    return [(podcast.name, podcast.host, podcast.logo.file_id or podcast.logo.url)
+            for podcast in Podcast.subscribe_by(user).order_by('-_updated_time')]
+
+
+def with_cards(user):
+    from castpod.components import ManagePage
+    from castpod.projections import subscribed_cards
+    ManagePage(subscribed_cards(user)).keyboard()
+    return [(podcast.name, podcast.host, podcast.logo_file_id or podcast.logo_url)
+            for podcast in subscribed_cards(user, sort=[('_updated_time', -1)])]
+
+
+def measure(func, user):
+    func(user)  # warm up
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        func(user)
+    elapsed = (time.perf_counter() - start) / REPEAT
+    tracemalloc.start()
+    func(user)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    connect(db=DB_NAME)
+    user = seed()
+    print(f"{'path':>10} {'ms':>8} {'peak KiB':>10}")
+    for name, func in (('documents', with_documents), ('cards', with_cards)):
+        elapsed, peak = measure(func, user)
+        print(f'{name:>10} {elapsed * 1000:>8.1f} {peak / 1024:>10.0f}')
+    connect(db=DB_NAME).drop_database(DB_NAME)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Round trips and wall time of Podcast.update_feed against episode count.
+
+Run from the repository root with a local mongod:
+
+    python -m benchmarks.update_feed
+"""
+import time
+import datetime
+import feedparser
+from pymongo import monitoring
+from mongoengine import connect
+
+DB_NAME = 'castpod_benchmark'
+COUNTS = [10, 100, 1000]
+NEW_EPISODES = 5
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def make_feed(count, start=0, name='benchmark'):
+    base = datetime.datetime(2010, 1, 1)
+    items = []
+    for i in reversed(range(start, count)):
+        published = (base + datetime.timedelta(days=i)
+                     ).strftime('%a, %d %b %Y %H:%M:%S +0000')
+        items.append(
+            f'<item><title>{name} #{i}</title><guid>{name}-{i}</guid>'
+            f'<enclosure url="https://cdn.example.com/{name}/{i}.mp3" length="{i}" type="audio/mpeg"/>'
+            f'<pubDate>{published}</pubDate><itunes:duration>01:00:00</itunes:duration>'
+            f'<description>&lt;p&gt;00:01 intro&lt;/p&gt;&lt;p&gt;10:00 topic {i}&lt;/p&gt;</description></item>'
+        )
+    return feedparser.parse(
+        '<?xml version="1.0"?>'
+        '<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd"><channel>'
+        f'<title>{name}</title><link>https://example.com</link>'
+        f'<itunes:image href="https://example.com/{name}.png"/>'
+        f'{"".join(items)}</channel></rss>'
+    )
+
+
+def measure(counter, func):
+    counter.count = 0
+    start = time.perf_counter()
+    func()
+    return counter.count, time.perf_counter() - start
+
+
+def main():
+    counter = CommandCounter()
+    connect(db=DB_NAME, event_listeners=[counter])
+    from castpod.models import Podcast, Episode
+    print(f"{'episodes':>8} {'init trips':>10} {'init s':>8} {'update trips':>12} {'update s':>8}")
+    for count in COUNTS:
+        Podcast.drop_collection()
+        Episode.drop_collection()
+        name = f'benchmark-{count}'
+        podcast = Podcast(feed=f'https://example.com/{name}.xml').save()
+        init = make_feed(count, name=name)
+        update = make_feed(count + NEW_EPISODES, name=name)
+        init_trips, init_time = measure(
+            counter, lambda: podcast.update_feed(init, init=True))
+        update_trips, update_time = measure(
+            counter, lambda: podcast.update_feed(update, init=False))
+        print(f'{count:>8} {init_trips:>10} {init_time:>8.3f} {update_trips:>12} {update_time:>8.3f}')
+    Podcast.drop_collection()
+    Episode.drop_collection()
+
+
+if __name__ == '__main__':
+    main()
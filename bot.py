@@ -1,7 +1,11 @@
 from telegram.ext import Updater
 from telegram import BotCommandScopeAllPrivateChats, BotCommandScopeAllGroupChats, BotCommandScopeAllChatAdministrators, BotCommandScopeChat
 from castpod.handlers import register_handlers
-from castpod.models import Podcast
+from castpod.models import Podcast, connect_telegraph, migrate_subscriptions, migrate_episodes, migrate_episode_texts, migrate_logos
+from castpod.refresh import FeedRefresher, RefreshScheduler
+from castpod.broadcast import broadcaster
+from castpod.warmup import warm_logos
+from castpod.shownotes import publisher
 import config
 from mongoengine import connect
 import datetime
@@ -25,24 +29,63 @@ connection = dispatcher.run_async(
     # host=Mongo.remote_host # for remote test
 )
 
+if connection.result():
+    print('MongoDB Connected!')
+else:
+    raise Exception('MongoDB Connection Failed.')
+# before any job runs, so none sees the data half migrated
+migrate_subscriptions()  # no-ops once the podcasts are migrated
+migrate_episodes()
+migrate_episode_texts()
+migrate_logos()
+connect_telegraph()  # the account that owns the shownotes pages
+
 register_handlers(dispatcher)
 
 
+refresher = FeedRefresher(workers=8, per_host=2, budget=300)
+scheduler = RefreshScheduler()
+
+
+def deliver(job):
+    # called by the download pipeline as soon as an episode is in the vault
+    if job.error:
+        dispatcher.bot.send_message(config.dev, f'{job.episode.title}: {job.error}')
+        return
+    broadcaster.enqueue(job.episode, job.podcast,
+                        job.message_id, job.podcast.iter_subscribers())
+    job.episode.update(set__is_downloaded=True)
+
+
 def update_podcasts(context):
-    for podcast in Podcast.objects:
-        message = podcast.check_update(context)
-        if message:
-            for subscriber in podcast.subscribers:
-                message.copy(subscriber.user_id)
+    scheduler.sync()
+    due = scheduler.pop_due()
+    if not due:
+        return
+    podcasts = list(Podcast.objects(id__in=due))
+    report = refresher.run(podcasts, context, deliver)
+    for podcast in podcasts:
+        if podcast in report.deferred:
+            scheduler.push(podcast.id, 0)  # try again on the next run
+        else:
+            scheduler.schedule(podcast)
 
 
-dispatcher.job_queue.run_repeating(
-    update_podcasts, 1200)  # run every 1200 s (20 min)
+def warm_up(context):
+    warm_logos(context.bot)
 
-if connection.result():
-    print('MongoDB Connected!')
-else:
-    raise Exception('MongoDB Connection Failed.')
+
+def publish_shownotes(context):
+    publisher.sweep()
+
+
+dispatcher.job_queue.run_repeating(
+    update_podcasts, 60)  # poll the podcasts that are due every 60 s
+# publish the shownotes of new episodes, and of any left by the last run
+dispatcher.job_queue.run_repeating(publish_shownotes, 60, first=10)
+# upload logos without a file_id, so inline results use cached photos
+dispatcher.job_queue.run_repeating(warm_up, 300, first=60)
+broadcaster.start(updater.bot)  # resumes deliveries left by the last run
 
 # set commands
 updater.bot.set_my_commands(
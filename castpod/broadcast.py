@@ -0,0 +1,188 @@
+import time
+import logging
+import datetime
+import threading
+from pymongo.errors import BulkWriteError
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton
+from telegram.utils.helpers import escape_markdown
+from telegram.error import RetryAfter, Unauthorized, BadRequest, TelegramError
+from config import podcast_vault
+from .models import Delivery, Setting
+from .constants import SPEAKER_MARK
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.time) * self.rate)
+                self.time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def digest_time(mode, now):
+    """When the digest of `mode` that is open at `now` is sent."""
+    if mode == 'hourly':
+        return now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+    digest = now.replace(hour=12, minute=0, second=0,
+                         microsecond=0)  # 20:00 in UTC+8
+    return digest if digest > now else digest + datetime.timedelta(days=1)
+
+
+class Broadcaster(object):
+    """Copy new episodes to subscribers from the persistent Delivery queue.
+
+    Sends stay under `rate` messages per second overall and one message per
+    `per_chat` seconds to each chat, and pause as long as Telegram asks with
+    RetryAfter. Deliveries are marked sent per batch, so after a restart at
+    most one batch is sent again. Users who chose a digest get one message
+    listing their new episodes when it is due instead.
+    """
+
+    def __init__(self, rate=25, per_chat=1, batch=100, max_attempts=5, idle=5):
+        self.bucket = TokenBucket(rate)
+        self.per_chat = per_chat
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.idle = idle
+        self.last_sent = {}  # chat id -> monotonic time of the last message
+        self.thread = None
+
+    def enqueue(self, episode, podcast, message_id, users):
+        now = datetime.datetime.utcnow()
+        docs = []
+        for user in users:
+            mode = (user.settings or Setting()).delivery
+            delivery = Delivery(user_id=user.user_id, podcast=podcast,
+                                episode=episode, message_id=message_id)
+            if mode != 'immediate':
+                delivery.status = 'digest'
+                delivery.due_time = digest_time(mode, now)
+            docs.append(delivery.to_mongo())
+        if not docs:
+            return
+        try:
+            Delivery._get_collection().insert_many(docs, ordered=False)
+        except BulkWriteError:  # already queued for some of the users
+            pass
+
+    def start(self, bot):
+        if not self.thread:
+            self.thread = threading.Thread(
+                target=self.run, args=(bot,), daemon=True)
+            self.thread.start()
+
+    def run(self, bot):
+        while True:
+            try:
+                if not (self.send_digests(bot) or self.send_batch(bot)):
+                    time.sleep(self.idle)
+            except Exception:
+                logger.exception('Failed to send a broadcast batch')
+                time.sleep(self.idle)
+
+    def send_batch(self, bot):
+        """Send one batch of due deliveries across all podcasts, returns False if none is due."""
+        now = datetime.datetime.utcnow()
+        batch = list(Delivery.objects(status='pending', due_time__lte=now).order_by(
+            'due_time').limit(self.batch))
+        if not batch:
+            return False
+        sent = []
+        for delivery in batch:
+            last_sent = self.last_sent.get(delivery.user_id)
+            if last_sent and time.monotonic() - last_sent < self.per_chat:
+                continue  # left for the next batch
+            self.bucket.take()
+            try:
+                bot.copy_message(delivery.user_id,
+                                 f'@{podcast_vault}', delivery.message_id)
+                self.last_sent[delivery.user_id] = time.monotonic()
+                sent.append(delivery.id)
+            except RetryAfter as e:
+                logger.warning(f'Broadcast paused for {e.retry_after}s')
+                time.sleep(e.retry_after)
+                break
+            except (Unauthorized, BadRequest) as e:  # blocked by the user, chat not found...
+                delivery.update(set__status='failed', set__error=str(e))
+            except TelegramError as e:
+                failed = delivery.attempts + 1 >= self.max_attempts
+                delivery.update(
+                    inc__attempts=1,
+                    set__error=str(e),
+                    set__status='failed' if failed else 'pending',
+                    set__due_time=datetime.datetime.utcnow() +
+                    datetime.timedelta(seconds=30 * 2 ** delivery.attempts)
+                )
+        if sent:
+            Delivery.objects(id__in=sent).update(
+                set__status='sent', set__sent_time=datetime.datetime.utcnow())
+        else:
+            time.sleep(self.per_chat)
+        self.last_sent = {chat: last for chat, last in self.last_sent.items()
+                          if time.monotonic() - last < self.per_chat}
+        return True
+
+    def send_digests(self, bot, size=10):
+        """Send the due digests of one batch of users, returns False if none is due."""
+        now = datetime.datetime.utcnow()
+        user_ids = Delivery.objects(
+            status='digest', due_time__lte=now).distinct('user_id')[:self.batch]
+        if not user_ids:
+            return False
+        for user_id in user_ids:
+            deliveries = list(Delivery.objects(
+                user_id=user_id, status='digest', due_time__lte=now).order_by('due_time'))
+            for start in range(0, len(deliveries), size):
+                chunk = deliveries[start:start+size]
+                # sent in the default Markdown, which names and titles must not break
+                lines = [f"{SPEAKER_MARK} *{escape_markdown(delivery.podcast.name)}*\n"
+                         f"{escape_markdown(delivery.episode.title)}"
+                         for delivery in chunk]
+                self.bucket.take()
+                try:
+                    bot.send_message(
+                        user_id,
+                        text='\n\n'.join(['*新节目汇总*'] + lines),
+                        reply_markup=InlineKeyboardMarkup.from_column(
+                            [InlineKeyboardButton(
+                                delivery.episode.title[:40], callback_data=f'digest_episode_{delivery.episode.id}')
+                             for delivery in chunk])
+                    )
+                    status = 'sent'
+                except RetryAfter as e:
+                    logger.warning(f'Broadcast paused for {e.retry_after}s')
+                    time.sleep(e.retry_after)
+                    return True
+                except TelegramError as e:
+                    logger.warning(f'Failed to send a digest to {user_id}: {e}')
+                    status = 'failed'
+                Delivery.objects(id__in=[delivery.id for delivery in chunk]).update(
+                    set__status=status, set__sent_time=datetime.datetime.utcnow())
+        return True
+
+    def __str__(self):
+        counts = {status: Delivery.objects(status=status).count()
+                  for status in ('pending', 'digest', 'sent', 'failed')}
+        return (
+            f"待发 {counts['pending']}，待汇总 {counts['digest']}，"
+            f"已发 {counts['sent']}，失败 {counts['failed']}"
+        )
+
+
+broadcaster = Broadcaster()
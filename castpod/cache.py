@@ -0,0 +1,160 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from config import audio_cache_size
+
+
+class AudioCache(object):
+    """Byte-bounded LRU index of the audio files under `root`.
+
+    Only files known to be uploaded to podcast_vault are evicted. Files left
+    by an earlier run are assumed uploaded once they are older than `grace`
+    seconds, as failed uploads are retried well within that. They may be
+    truncated by downloads written in place before `.part` files, so they are
+    only trusted when as large as the episode.
+    """
+
+    def __init__(self, root, budget, grace=86400):
+        self.root = root
+        self.budget = budget
+        self.grace = grace
+        self.lock = threading.Lock()
+        # path -> [size, uploaded], least recent first. `uploaded` of files
+        # found on disk is their mtime until they are known to be uploaded.
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.scanned = False
+
+    def scan(self):
+        files = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if not path.endswith('.part'):
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, path, stat.st_size))
+        for mtime, path, size in sorted(files):
+            self.entries[path] = [size, mtime]
+            self.size += size
+        self.scanned = True
+
+    def lookup(self, path, size=None):
+        """Return True if a complete copy of `path`, of `size` bytes if known, is on disk."""
+        with self.lock:
+            if not self.scanned:
+                self.scan()
+            entry = self.entries.get(path)
+            # files added by this run are complete, found ones may not be
+            if entry and not isinstance(entry[1], bool) and not (size and entry[0] >= size):
+                del self.entries[path]
+                self.size -= entry[0]
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                entry = None
+            if entry and os.path.exists(path):
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def add(self, path):
+        with self.lock:
+            if not self.scanned:
+                self.scan()
+            if path in self.entries:
+                self.size -= self.entries[path][0]
+            size = os.path.getsize(path)
+            self.entries[path] = [size, False]
+            self.size += size
+            self.evict()
+
+    def mark_uploaded(self, path):
+        with self.lock:
+            if path in self.entries:
+                self.entries[path][1] = True
+                self.evict()
+
+    def evict(self):
+        for path, (size, uploaded) in list(self.entries.items()):
+            if self.size <= self.budget:
+                return
+            if uploaded is False or (uploaded is not True and
+                                     time.time() - uploaded < self.grace):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            del self.entries[path]
+            self.size -= size
+
+    def __str__(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            rate = self.hits / lookups * 100 if lookups else 0
+            return (
+                f'{len(self.entries)} 个文件，'
+                f'{self.size / 1073741824:.2f}/{self.budget / 1073741824:.2f} GB，'
+                f'命中率 {rate:.0f}% ({self.hits}/{lookups})'
+            )
+
+
+class TTLCache(object):
+    """LRU cache of at most `maxsize` values, each kept for `ttl` seconds.
+
+    Used for documents read on every update, writers invalidate the keys
+    they change, and the ttl bounds how stale the rest can get.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expiry, value), least recent first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """Return the value of `key`, calling `load()` for it if missing or expired."""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        value = load()
+        if value is not None:
+            with self.lock:
+                self.entries[key] = (now + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def __str__(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            rate = self.hits / lookups * 100 if lookups else 0
+            return f'{len(self.entries)}/{self.maxsize} 条，命中率 {rate:.0f}% ({self.hits}/{lookups})'
+
+
+audio_cache = AudioCache('public/audio', audio_cache_size)
+user_cache = TTLCache(4096, 300)  # user_id -> User
+# (kind, user_id) -> ids of the podcasts a user subscribes to or stars
+relation_cache = TTLCache(4096, 300)
+podcast_cache = TTLCache(1024, 300)  # podcast id -> PodcastCard
+# podcast id -> (episode id, lowercase summary) of its episodes, for searches as you type
+summary_cache = TTLCache(32, 600)
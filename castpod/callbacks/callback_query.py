@@ -1,9 +1,11 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from castpod.components import PodcastPage, ManagePage
-from castpod.models import User, Podcast, Episode
+from castpod.models import User, Podcast, Episode, Setting, Star
+from castpod.projections import podcast_card, subscribed_cards
 from castpod.utils import delete_manage_starter, save_manage_starter, generate_opml
 from .command import settings as command_settings
 from .command import help_ as command_help
+from . import message as message_callbacks
 from config import manifest
 from ..constants import TICK_MARK, STAR_MARK
 from datetime import date
@@ -56,6 +58,18 @@ def delete_account(update, context):
 # Podcast
 
 
+def digest_episode(update, context):
+    query = update.callback_query
+    episode_id = re.match(
+        r'digest_episode_(.+)',
+        query.data
+    )[1]
+    episode = Episode.objects.get(id=episode_id)
+    message_callbacks.send_episode(
+        context.bot, update.effective_chat.id, episode.from_podcast, episode, episode.message_id)
+    query.answer()
+
+
 def fav_ep(update, context):
     query = update.callback_query
     episode_id = re.match(
@@ -110,12 +124,12 @@ def unfav_podcast(update, context):
 
 def toggle_fav_podcast(update, context, to: str):
     query = update.callback_query
-    user = User.objects.get(user_id=update.effective_user.id)
+    user = User.validate_user(update.effective_user)
     podcast_id = re.match(
         r'(un)?fav_podcast_(.+)',
         query.data
     )[2]
-    podcast = Podcast.objects.get(id=podcast_id)
+    podcast = podcast_card(podcast_id)
     kwargs = {}
 
     if (to == 'fav'):
@@ -124,7 +138,7 @@ def toggle_fav_podcast(update, context, to: str):
             'fav_action': "unfav_podcast"
         }
 
-    user.toggle_fav(podcast)
+    user.toggle_fav(podcast.id)
     keyboard = PodcastPage(podcast, **kwargs).keyboard()
     context.dispatcher.run_async(
         query.edit_message_reply_markup,
@@ -136,7 +150,7 @@ def unsubscribe_podcast(update, context):
     run_async = context.dispatcher.run_async
     query = update.callback_query
     podcast_id = re.match(r'unsubscribe_podcast_(.+)', query.data)[1]
-    podcast_name = Podcast.objects(id=podcast_id).only('name').first().name
+    podcast_name = podcast_card(podcast_id).name
     run_async(
         query.message.edit_text,
         text=f"确认退订 {podcast_name} 吗？",
@@ -153,12 +167,12 @@ def confirm_unsubscribe(update, context):
     run_async = context.dispatcher.run_async
     query = update.callback_query
     podcast_id = re.match(r'confirm_unsubscribe_(.+)', query.data)[1]
-    user = User.objects.get(user_id=query.from_user.id)
-    podcast = Podcast.objects.get(id=podcast_id)
-    user.unsubscribe(podcast)
+    user = User.validate_user(query.from_user)
+    podcast = podcast_card(podcast_id)
+    user.unsubscribe(podcast.id)
 
     manage_page = ManagePage(
-        podcasts=Podcast.subscribe_by(user, 'name'),
+        podcasts=subscribed_cards(user),
         text=f'`{podcast.name}` 退订成功'
     )
     run_async(query.message.delete)
@@ -175,10 +189,10 @@ def confirm_unsubscribe(update, context):
 
 def back_to_actions(update, context):
     query = update.callback_query
-    user = User.objects.get(user_id=query.from_user.id)
+    user = User.validate_user(query.from_user)
     podcast_id = re.match(r'back_to_actions_(.+)', query.data)[1]
-    podcast = Podcast.objects.get(id=podcast_id)
-    if user in podcast.starrers:
+    podcast = podcast_card(podcast_id)
+    if Star.exists(user, podcast.id):
         page = PodcastPage(podcast, fav_text=STAR_MARK,
                            fav_action="unfav_podcast")
     else:
@@ -196,11 +210,10 @@ def export_before_logout(update, context):
     run_async = context.dispatcher.run_async
     user = User.validate_user(update.effective_user)
     message = update.callback_query.message
-    podcasts = Podcast.objects(subscribers__in=[user])
-    if not podcasts:
+    subscribed_podcasts = Podcast.subscribe_by(user)
+    if not subscribed_podcasts:
         run_async(message.reply_text, '还没有订阅播客，请先订阅后导出~')
         return
-    subscribed_podcasts = Podcast.subscribe_by(user)
     run_async(
         message.reply_document,
         filename=f"castpod-{date.today()}.xml",
@@ -218,11 +231,10 @@ def export(update, context):
     run_async = context.dispatcher.run_async
     user = User.validate_user(update.effective_user)
     message = update.callback_query.message
-    podcasts = Podcast.objects(subscribers__in=[user])
-    if not podcasts:
+    subscribed_podcasts = Podcast.subscribe_by(user)
+    if not subscribed_podcasts:
         run_async(message.reply_text, '还没有订阅播客，请先订阅后导出~')
         return
-    subscribed_podcasts = Podcast.subscribe_by(user)
     run_async(
         message.reply_document,
         filename=f"castpod-{date.today()}.xml",
@@ -270,16 +282,43 @@ def display_setting(update, context):
 
 
 def feed_setting(update, context):
+    user = User.validate_user(update.effective_user)
+    settings = user.settings or Setting()
+    modes = {'immediate': '即时', 'hourly': '每小时汇总', 'daily': '每日汇总'}
     context.dispatcher.run_async(
         update.callback_query.edit_message_text,
         text=f"点击修改推送设置：",
         reply_markup=InlineKeyboardMarkup.from_column(
-            [InlineKeyboardButton("更新频率    60 分钟", callback_data="feed_freq"),
+            [InlineKeyboardButton(f"更新频率    {settings.feed_freq} 分钟", callback_data="feed_freq"),
+             InlineKeyboardButton(
+                 f"推送方式    {modes[settings.delivery]}", callback_data="delivery_mode"),
              InlineKeyboardButton('返回', callback_data="settings")
              ])
     )
 
 
+def feed_freq(update, context):
+    user = User.validate_user(update.effective_user)
+    settings = user.settings or Setting()
+    freqs = [15, 30, 60, 180, 720]
+    settings.feed_freq = next(
+        (freq for freq in freqs if freq > settings.feed_freq), freqs[0])
+    user.settings = settings  # the user may be cached
+    user.update(set__settings=settings)
+    feed_setting(update, context)
+
+
+def delivery_mode(update, context):
+    user = User.validate_user(update.effective_user)
+    settings = user.settings or Setting()
+    modes = ['immediate', 'hourly', 'daily']
+    settings.delivery = modes[(modes.index(
+        settings.delivery) + 1) % len(modes)]
+    user.settings = settings  # the user may be cached
+    user.update(set__settings=settings)
+    feed_setting(update, context)
+
+
 def host_setting(update, context):
     context.dispatcher.run_async(
         update.callback_query.edit_message_text,
@@ -2,7 +2,11 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMa
 from config import manifest
 from castpod.models import User, Podcast, Episode
 from castpod.components import ManagePage, PodcastPage
+from castpod.projections import subscribed_cards, starred_cards
 from castpod.utils import save_manage_starter, delete_update_message, delete_manage_starter
+from castpod import network
+from castpod.cache import audio_cache, user_cache, relation_cache, podcast_cache, summary_cache
+from castpod.broadcast import broadcaster
 from manifest import manifest
 from ..constants import RIGHT_SEARCH_MARK, DOC_MARK
 import re
@@ -44,14 +48,14 @@ def start(update, context):
                 update.reply_message(
                     f'抱歉，该播客不存在。如需订阅，请尝试在对话框输入 `@{manifest.bot_id} 播客关键词` 检索。')
                 return
-            if not user in podcast.subscribers:
+            if not user.is_subscribed(podcast):
                 subscribing_note = run_async(
                     update.message.reply_text, "正在订阅…").result()
                 user.subscribe(podcast)
                 run_async(subscribing_note.delete)
             page = PodcastPage(podcast)
             manage_page = ManagePage(
-                Podcast.subscribe_by(user), f'`{podcast.name}` 订阅成功！'
+                subscribed_cards(user), f'`{podcast.name}` 订阅成功！'
             )
             photo = podcast.logo.file_id or podcast.logo.url
             msg = run_async(message.reply_photo,
@@ -61,6 +65,7 @@ def start(update, context):
                             parse_mode="HTML"
                             ).result()
             podcast.logo.file_id = msg.photo[0].file_id
+            podcast.logo.file_url = podcast.logo.url
             podcast.save()
 
             run_async(
@@ -91,7 +96,7 @@ def manage(update, context):
     run_async = context.dispatcher.run_async
     user = User.validate_user(update.effective_user)
 
-    page = ManagePage(Podcast.subscribe_by(user, 'name'))
+    page = ManagePage(subscribed_cards(user))
     msg = run_async(
         update.effective_message.reply_text,
         text=page.text,
@@ -107,7 +112,7 @@ def star(update, context):
     run_async = context.dispatcher.run_async
     user = User.validate_user(update.effective_user)
 
-    page = ManagePage(Podcast.star_by(user, 'name'), text='已启动收藏面板')
+    page = ManagePage(starred_cards(user), text='已启动收藏面板')
     msg = run_async(
         update.message.reply_text,
         text=page.text,
@@ -240,6 +245,20 @@ def bonus(update, context):
     )
 
 
+def stat(update, context):
+    update.message.reply_text(
+        text=(
+            f"*HTTP*\n{network.stats}\n\n"
+            f"*音频缓存*\n{audio_cache}\n\n"
+            f"*推送*\n{broadcaster}\n\n"
+            f"*用户缓存*\n{user_cache}\n"
+            f"*订阅缓存*\n{relation_cache}\n"
+            f"*播客缓存*\n{podcast_cache}\n"
+            f"*简介缓存*\n{summary_cache}"
+        )
+    )
+
+
 def test(update, context):
     context.bot.send_audio(
         chat_id=f'@test_vault',
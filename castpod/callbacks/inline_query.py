@@ -1,9 +1,9 @@
-from mongoengine.queryset.visitor import Q
 from ..utils import search_itunes
 from telegram import InlineQueryResultArticle, InputTextMessageContent, InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultCachedPhoto, InlineQueryResultPhoto, InlineQueryResultCachedAudio
 import re
 from config import manifest
-from ..models import User, Podcast, Episode
+from ..models import User, Podcast
+from ..projections import subscribed_cards, search_subscribed_episodes
 import datetime
 from ..constants import SPEAKER_MARK
 
@@ -23,8 +23,7 @@ def via_sender(update, context):
     match = re.match(r'(.*?)#(.*)$', keywords)
     try:
         name, index = match[1], match[2]
-        podcast = Podcast.objects.get(
-            Q(name=name) & Q(subscribers=user))
+        podcast = Podcast.subscribe_by(user).get(name=name)
         results = show_episodes(podcast, index)
     except:
         results = search_podcast(user, keywords)
@@ -56,8 +55,7 @@ def via_channel(update, context):
 def search_podcast(user, keywords):
     searched_results = search_itunes(keywords)
     if not searched_results:
-        podcasts = Podcast.objects(
-            Q(name__icontains=keywords) & Q(subscribers=user))
+        podcasts = subscribed_cards(user, keywords)
         if not podcasts:
             yield InlineQueryResultArticle(
                 id='0',
@@ -81,10 +79,10 @@ def search_podcast(user, keywords):
                 )
             )
             for index, podcast in enumerate(podcasts):
-                if podcast.logo.file_id:
+                if podcast.logo_file_id:
                     yield InlineQueryResultCachedPhoto(
                         id=index,
-                        photo_file_id=podcast.logo.file_id,
+                        photo_file_id=podcast.logo_file_id,
                         title=str(podcast.name),
                         description=podcast.host or podcast.name,
                         # photo_url=podcast.logo.url,
@@ -96,8 +94,8 @@ def search_podcast(user, keywords):
                     yield InlineQueryResultPhoto(
                         id=index,
                         description=podcast.host or podcast.name,
-                        photo_url=podcast.logo.url,
-                        thumb_url=podcast.logo.url,
+                        photo_url=podcast.logo_url,
+                        thumb_url=podcast.logo_url,
                         photo_width=80,
                         photo_height=80,
                         title=str(podcast.name),
@@ -128,8 +126,7 @@ def search_podcast(user, keywords):
 
 
 def show_subscription(user):
-    podcasts = Podcast.objects(
-        subscribers=user).order_by('-updated_time')
+    podcasts = subscribed_cards(user, sort=[('_updated_time', -1)])
     if not podcasts:
         yield InlineQueryResultArticle(
             id=0,
@@ -143,10 +140,10 @@ def show_subscription(user):
         )
     else:
         for index, podcast in enumerate(podcasts):
-            if podcast.logo.file_id:
+            if podcast.logo_file_id:
                 yield InlineQueryResultCachedPhoto(
                     id=str(index),
-                    photo_file_id=podcast.logo.file_id,
+                    photo_file_id=podcast.logo_file_id,
                     title=str(podcast.name),
                     description=podcast.host or podcast.name,
                     # photo_url=podcast.logo.url,
@@ -158,8 +155,8 @@ def show_subscription(user):
                 yield InlineQueryResultPhoto(
                     id=str(index),
                     description=podcast.host or podcast.name,
-                    photo_url=podcast.logo.url,
-                    thumb_url=podcast.logo.url,
+                    photo_url=podcast.logo_url,
+                    thumb_url=podcast.logo_url,
                     photo_width=80,
                     photo_height=80,
                     title=str(podcast.name),
@@ -177,30 +174,22 @@ def show_episodes(podcast, index):
     if index:
         if re.match(r'^-?[0-9]*$', index):
             index = int(index)
-            if abs(index) <= len(podcast.episodes):
-                if index >= 0:
-                    index = -index
-                    episodes = podcast.episodes[max(
-                        index-3, -len(podcast.episodes)): min(index+2, -1)]
-                else:
-                    index = abs(index + 1)
-                    episodes = podcast.episodes[max(
-                        index-3, 0): min(index+2, len(podcast.episodes))]
+            count = podcast.episode_count
+            if abs(index) <= count:
+                if index < 0:  # counted from the latest episode
+                    index += count + 1
+                episodes = podcast.episodes(index - 1, index + 3)
             else:
                 yield InlineQueryResultArticle(
                     id=0,
                     title='超出检索范围',
                     input_message_content=InputTextMessageContent(':('),
                     # !!如果 podcast.episodes.count() == 1
-                    description=f"请输入 1 ～ {len(podcast.episodes)} 之间的数字",
+                    description=f"请输入 1 ～ {count} 之间的数字",
                 )
                 return
         else:
-            episodes = Episode.objects(
-                Q(from_podcast=podcast) & Q(title__icontains=index)
-            ).order_by('-published_time') or Episode.objects(
-                Q(from_podcast=podcast) & Q(summary__icontains=index)
-            ).order_by('-published_time')
+            episodes = podcast.search_episodes(index)
             if not episodes:
                 yield InlineQueryResultArticle(
                     id=0,
@@ -210,7 +199,7 @@ def show_episodes(podcast, index):
                 )
                 return
     else:
-        episodes = podcast.episodes
+        episodes = podcast.episodes()
     for index, episode in enumerate(episodes):
         if episode.file_id:
             yield InlineQueryResultCachedAudio(
@@ -218,7 +207,7 @@ def show_episodes(podcast, index):
                 audio_file_id=episode.file_id,
                 reply_markup=InlineKeyboardMarkup.from_row(buttons),
                 input_message_content=InputTextMessageContent((
-                    f"[{SPEAKER_MARK}]({podcast.logo.url}) *{podcast.name}* #{len(podcast.episodes)-index}"
+                    f"[{SPEAKER_MARK}]({podcast.logo.url}) *{podcast.name}* #{episode.number}"
                 )),
             )
         else:
@@ -226,10 +215,10 @@ def show_episodes(podcast, index):
                 id=index,
                 title=episode.title,
                 input_message_content=InputTextMessageContent((
-                    f"[{SPEAKER_MARK}]({podcast.logo.url}) *{podcast.name}* #{len(podcast.episodes)-index}"
+                    f"[{SPEAKER_MARK}]({podcast.logo.url}) *{podcast.name}* #{episode.number}"
                 )),
                 reply_markup=InlineKeyboardMarkup.from_row(buttons),
-                description=f"{datetime.timedelta(seconds=episode.duration) or podcast.name}\n{episode.subtitle}",
+                description=f"{datetime.timedelta(seconds=episode.duration) or podcast.name}\n{episode.subtitle or episode.preview or ''}",
                 thumb_url=episode.logo.url,
                 thumb_width=80,
                 thumb_height=80
@@ -249,13 +238,9 @@ def get_invitation(user):
 
 
 def share_podcast(user, keywords):
-    podcasts = Podcast.objects(
-        Q(name__icontains=keywords) & Q(subscribers=user))
+    podcasts = subscribed_cards(user, keywords)
     if not podcasts:
-        podcasts_of_user = Podcast.objects(subscribers=user).only('episodes')
-        episodes = Episode.objects(
-            Q(title__icontains=keywords) & Q(from_podcast__in=podcasts_of_user)
-        )
+        episodes = search_subscribed_episodes(user, keywords)
         if not episodes:
             yield InlineQueryResultArticle(
                 id=0,
@@ -266,19 +251,19 @@ def share_podcast(user, keywords):
             return
         else:
             for index, episode in enumerate(episodes):
-                podcast = episode.from_podcast
+                podcast = episode.podcast
                 email = f'\n✉️  {podcast.email}' if podcast.email else ''
                 yield InlineQueryResultArticle(
                     id=index,
                     title=episode.title,
                     description=podcast.name,
-                    thumb_url=episode.logo.url,
+                    thumb_url=episode.logo_url or podcast.logo_url,
                     thumb_width=60,
                     thumb_height=60,
                     input_message_content=InputTextMessageContent(
                         message_text=(
                             f'*{podcast.name}*'
-                            f'\n[{SPEAKER_MARK}]({podcast.logo.url}) {podcast.host or podcast.name}'
+                            f'\n[{SPEAKER_MARK}]({podcast.logo_url}) {podcast.host or podcast.name}'
                             f'{email}'
                         )
                     ),
@@ -291,13 +276,13 @@ def share_podcast(user, keywords):
             id=index,
             title=podcast.name,
             description=podcast.host,
-            thumb_url=podcast.logo.url,
+            thumb_url=podcast.logo_url,
             thumb_width=60,
             thumb_height=60,
             input_message_content=InputTextMessageContent(
                 message_text=(
                     f'*{podcast.name}*'
-                    f'\n[{SPEAKER_MARK}]({podcast.logo.url}) {podcast.host or podcast.name}'
+                    f'\n[{SPEAKER_MARK}]({podcast.logo_url}) {podcast.host or podcast.name}'
                     f'{email}'
                 )
             ),
@@ -1,9 +1,11 @@
-from ..models import User, Podcast
+from ..models import User, Podcast, Episode
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ChatAction, ParseMode, ReplyKeyboardRemove
 from ..components import PodcastPage, ManagePage
+from ..projections import subscribed_cards
 from config import podcast_vault, manifest, dev
-from ..utils import delete_update_message, download, parse_doc, delete_manage_starter, save_manage_starter
-from mongoengine.queryset.visitor import Q
+from ..utils import delete_update_message, parse_doc, delete_manage_starter, save_manage_starter
+from ..vault import downloader
+from ..importer import importer
 from mongoengine.errors import DoesNotExist
 from ..constants import RIGHT_SEARCH_MARK, SPEAKER_MARK, STAR_MARK, DOC_MARK, FAV_MARK
 import re
@@ -31,7 +33,7 @@ def subscribe_feed(update, context):
     kwargs = {'mode': 'group'} if in_group else {}
     try:
         manage_page = ManagePage(
-            podcasts=Podcast.subscribe_by(user, 'name'),
+            podcasts=subscribed_cards(user),
             text=f"`{podcast.name}` 订阅成功！"
         )
         run_async(subscribing_message.delete)
@@ -55,6 +57,7 @@ def subscribe_feed(update, context):
                         parse_mode="HTML"
                         ).result()
         podcast.logo.file_id = msg.photo[0].file_id
+        podcast.logo.file_url = podcast.logo.url
         podcast.save()
         run_async(message.delete)
     except Exception as e:
@@ -71,28 +74,19 @@ def save_subscription(update, context):
         feeds = run_async(
             parse_doc, context, user, message.document
         ).result()
-        feeds_count = len(feeds)
         subscribing_note = run_async(
-            parsing_note.edit_text, f"订阅中 (0/{feeds_count})").result()
-        podcasts_count = 0
-        failed_feeds = []
-        for feed in feeds:
-            podcast = None
-            try:
-                podcast = Podcast.validate_feed(feed['url'].lower())
-                user.subscribe(podcast)
-                podcasts_count += 1
-            except Exception as e:
-                podcast.delete()
-                failed_feeds.append(feed['url'])
-                continue
-            run_async(
-                subscribing_note.edit_text, f"订阅中 ({podcasts_count}/{feeds_count})"
-            )
+            parsing_note.edit_text, "订阅中…").result()
+        # feeds are parsed as the importer reads them
+        podcasts, failed_feeds = importer.run(
+            user, (feed['url'] for feed in feeds),
+            progress=lambda done, total: run_async(
+                subscribing_note.edit_text, f"订阅中 ({done}/{total})")
+        )
+        podcasts_count = len(podcasts)
 
         if podcasts_count:
             newline = '\n'
-            reply = f"成功订阅 {feeds_count} 部播客！" if not len(failed_feeds) else (
+            reply = f"成功订阅 {podcasts_count} 部播客！" if not len(failed_feeds) else (
                 f"成功订阅 {podcasts_count} 部播客，部分订阅源解析失败。"
                 f"\n\n可能损坏的订阅源："
                 # use Reduce ?
@@ -102,7 +96,7 @@ def save_subscription(update, context):
             reply = "订阅失败:( \n\n请检查订阅文件以及其中的订阅源是否受损"
 
         manage_page = ManagePage(
-            podcasts=Podcast.subscribe_by(user, 'name'),
+            podcasts=subscribed_cards(user),
             text=reply
         )
 
@@ -138,11 +132,9 @@ def download_episode(update, context):
     match = re.match(f'{SPEAKER_MARK} (.+) #([0-9]+)', message.text)
     user = User.validate_user(update.effective_user)
     # podcast = Podcast.objects.get(name=match[1])
-    podcast = Podcast.objects.get(
-        Q(name=match[1]) & Q(subscribers=user))  # ⚠️ name改成id，且这一段代码与 handle_audio 重复
-    context.user_data.update({'podcast': podcast.name, 'chat_id': chat_id})
-    index = int(match[2])
-    episode = podcast.episodes[-index]
+    podcast = Podcast.subscribe_by(user).get(
+        name=match[1])  # ⚠️ name改成id，且这一段代码与 handle_audio 重复
+    episode = podcast.episode(int(match[2]))
     bot.send_chat_action(
         chat_id,
         ChatAction.UPLOAD_AUDIO
@@ -150,60 +142,47 @@ def download_episode(update, context):
 
     if episode.message_id:
         fetching_note.delete()
-        forwarded_message = bot.forward_message(
-            chat_id=chat_id,
-            from_chat_id=f"@{podcast_vault}",
-            message_id=episode.message_id
-        )
-        forward_from_message = episode.message_id
+        send_episode(bot, chat_id, podcast, episode, episode.message_id)
     else:
         downloading_note = fetching_note.edit_text("下载中…")
-        audio_file = download(episode, context)
-        uploading_note = downloading_note.edit_text("发送中，请稍候…")
-        audio_message = None
-        try:
-            audio_message = bot.send_audio(
-                chat_id=f'@{podcast_vault}',
-                audio=audio_file,
-                caption=(
-                    f"{SPEAKER_MARK} *{podcast.name}*\n"
-                    f"总第 {index} 期\n\n"
-                    f"#{podcast.id}"
-                ),
-                reply_markup=InlineKeyboardMarkup.from_row(
-                    [InlineKeyboardButton('订阅', url=f'https://t.me/{manifest.bot_id}?start=p{podcast.id}'),
-                     InlineKeyboardButton('相关链接', url=episode.shownotes_url)]
-                ),
-                title=episode.title,
-                performer=podcast.name,
-                duration=episode.duration,
-                thumb=episode.logo.path
-            )
-        except Exception as e:
-            raise e
-        finally:
-            uploading_note.delete()
-        forwarded_message = audio_message.forward(chat_id)
-        forward_from_message = audio_message.message_id
-        episode.update(set__message_id=audio_message.message_id)
-        episode.update(set__file_id=audio_message.audio.file_id)
-        context.user_data.clear()  # !!!
+
+        def deliver(job):
+            downloading_note.delete()
+            if job.error:
+                bot.send_message(chat_id, "下载失败，请稍后再试 :(")
+            else:
+                send_episode(bot, chat_id, podcast, episode, job.message_id)
+        # the download is shared with other chats asking for this episode,
+        # and does not hold this dispatcher worker
+        downloader.request(bot, episode, podcast,
+                           waiter=deliver, chat_id=chat_id)
+    update.message.delete()
+
+
+def send_episode(bot, chat_id, podcast, episode, message_id):
+    forwarded_message = bot.forward_message(
+        chat_id=chat_id,
+        from_chat_id=f"@{podcast_vault}",
+        message_id=message_id
+    )
+    buttons = [
+        InlineKeyboardButton(
+            '收藏', callback_data=f'fav_ep_{episode.id}'),
+        InlineKeyboardButton(
+            '分享', switch_inline_query=f'{podcast.name}#{episode.id}')
+    ]
+    if episode.shownotes_url or podcast.website:  # None until the shownotes are published
+        buttons.insert(0, InlineKeyboardButton(
+            '简介', url=episode.shownotes_url or podcast.website))
     forwarded_message.edit_caption(
         caption=(
             # f"{SPEAKER_MARK} <b>{podcast.name}</b>\n\n"
-            # f"<a href='https://t.me/{podcast_vault}/{forward_from_message}'>留言区</a>\n\n"
+            # f"<a href='https://t.me/{podcast_vault}/{message_id}'>留言区</a>\n\n"
             f"{episode.timeline}"
         ),
         parse_mode=ParseMode.HTML,
         reply_markup=InlineKeyboardMarkup([
-            [
-                InlineKeyboardButton(
-                    '简介', url=episode.shownotes_url or podcast.website),
-                InlineKeyboardButton(
-                    '收藏', callback_data=f'fav_ep_{episode.id}'),
-                InlineKeyboardButton(
-                    '分享', switch_inline_query=f'{podcast.name}#{episode.id}')
-            ],
+            buttons,
             [
                 InlineKeyboardButton(
                     "订阅列表", switch_inline_query_current_chat=""),
@@ -211,7 +190,6 @@ def download_episode(update, context):
                     "单集列表", switch_inline_query_current_chat=f"{podcast.name}#")
             ]])
     )
-    update.message.delete()
 
 
 @delete_update_message
@@ -236,17 +214,16 @@ def show_podcast(update, context):
     kwargs = {'mode': 'group'} if in_group else {}
     podcast = None
     try:
-        podcast = Podcast.objects.get(
-            Q(name=message.text) & Q(subscribers=user))
+        podcast = Podcast.subscribe_by(user).get(name=message.text)
     except Exception as e:
-        podcast = Podcast.objects(
-            subscribers=user).search_text(message.text).first()
+        podcast = Podcast.subscribe_by(
+            user).search_text(message.text).first()
     finally:
         if not podcast:
             run_async(message.reply_text, '抱歉，没能理解这条指令。')
             return
 
-        if user in podcast.starrers:
+        if user.has_starred(podcast):
             kwargs.update(
                 {
                     'fav_text': STAR_MARK,
@@ -263,6 +240,7 @@ def show_podcast(update, context):
                         parse_mode="HTML"
                         ).result()
         podcast.logo.file_id = msg.photo[0].file_id
+        podcast.logo.file_url = podcast.logo.url
         podcast.save()
         run_async(update.message.delete)
 
@@ -272,16 +250,13 @@ def handle_audio(update, context):
     if not (message and (message.from_user.id == 777000)):
         return
     match = re.match(f'{SPEAKER_MARK} .+?\n总第 ([0-9]+) 期', message.caption)
-    index = int(match[1])
+    number = int(match[1])
     podcast_id = list(message.parse_caption_entities().values()
                       )[-1].replace('#', '')
-    podcast = Podcast.objects(id=podcast_id).only('episodes').first()
-    episodes = podcast.episodes
-    episodes[-index].update(set__message_id=message.forward_from_message_id)
-    episodes[-index].update(set__file_id=message.audio.file_id)
-    podcast.update(set__episodes=episodes)
-    episodes[-index].reload()
-    podcast.reload()
+    Episode.objects(from_podcast=podcast_id, number=number).update_one(
+        set__message_id=message.forward_from_message_id,
+        set__file_id=message.audio.file_id
+    )
 
 
 @delete_update_message
@@ -39,12 +39,11 @@ class ManagePage(object):
         self.text = text
 
     def row(self, i):
-        row = [podcast.name for index, podcast in enumerate(
-            self.podcasts) if index // 3 == i]
+        row = [podcast.name for podcast in self.podcasts[i*3:i*3+3]]
         return row
 
     def keyboard(self, null_text='探索播客世界', jump_to=STAR_MARK):
-        podcasts_count = self.podcasts.count()
+        podcasts_count = len(self.podcasts)
         if not podcasts_count:
             return [[QUIT_MARK, jump_to],[null_text]]
         rows_count = podcasts_count // 3 + bool(podcasts_count % 3)
@@ -0,0 +1,56 @@
+import zlib
+from bson import Binary
+from mongoengine.base import BaseField
+
+
+def compress(text, level=6):
+    return Binary(zlib.compress(text.encode(), level))
+
+
+def decompress(value):
+    """Text of a stored value, which is compressed bytes or text stored before compression."""
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode()
+    return value
+
+
+class CompressedTextField(BaseField):
+    """Text stored zlib-compressed.
+
+    Documents keep the compressed bytes they are loaded with, and decompress
+    them on first access, so loading an episode costs nothing for the text
+    that is not read. The contents cannot be queried.
+    """
+
+    def __init__(self, level=6, **kwargs):
+        self.level = level
+        super().__init__(**kwargs)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance._data.get(self.name)
+        if isinstance(value, bytes):
+            value = decompress(value)
+            instance._data[self.name] = value  # not a change, saved as it was
+        return value
+
+    def to_python(self, value):
+        return bytes(value) if isinstance(value, bytes) else value
+
+    def to_mongo(self, value):
+        if isinstance(value, str):
+            return compress(value, self.level)
+        return Binary(value)
+
+    def validate(self, value):
+        if not isinstance(value, (str, bytes)):
+            self.error('CompressedTextField only accepts str values')
+
+    def prepare_query_value(self, op, value):
+        if op in ('set', 'setOnInsert') and value is not None:
+            self.validate(value)
+            return self.to_mongo(value)
+        if op not in (None, 'exists', 'ne') or value is not None:
+            self.error('Compressed text can only be set or compared to None')
+        return value
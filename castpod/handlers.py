@@ -2,6 +2,7 @@ from castpod.callbacks import *
 from .constants import QUIT_MARK, SPEAKER_MARK, STAR_MARK, DOC_MARK
 from telegram.ext import MessageHandler, Filters, InlineQueryHandler, CommandHandler, CallbackQueryHandler, ConversationHandler
 from telegram import Chat
+from config import dev
 import inspect
 
 RSS, CONFIRM, PHOTO = range(3)
@@ -30,6 +31,8 @@ def register_handlers(dispatcher):
         CommandHandler('settings', command.settings),
         CommandHandler('help', command.help_, run_async=True),
         CommandHandler('about', command.about, run_async=True),
+        CommandHandler('stat', command.stat,
+                       filters=Filters.user(int(dev)), run_async=True),
         MessageHandler(
             (Filters.via_bot(dispatcher.bot.get_me().id) | Filters.chat_type.private) & Filters.entity("url") & Filters.regex(r'^https?://'), message.subscribe_feed),
         MessageHandler(
@@ -0,0 +1,96 @@
+import time
+import logging
+import datetime
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from pymongo import UpdateOne
+from .models import Podcast, Subscription
+from .cache import relation_cache
+
+logger = logging.getLogger(__name__)
+
+
+class OpmlImporter(object):
+    """Subscribe a user to the feeds of an OPML file.
+
+    Podcasts already stored with a name are reused as they are. The others
+    are fetched and parsed by `workers` threads, at most `per_host` of them
+    from the same host. All subscriptions are then written in one bulk
+    write. `progress` is called at most every `interval` seconds.
+
+    `urls` may be a generator, it is read `batch` urls at a time, so
+    fetching starts while the rest of the file is still parsed.
+    """
+
+    def __init__(self, workers=8, per_host=2, interval=3, batch=100):
+        self.workers = workers
+        self.per_host = per_host
+        self.interval = interval
+        self.batch = batch
+
+    def run(self, user, urls, progress=None):
+        """Returns the podcasts subscribed to and the urls that failed."""
+        seen = set()
+        podcasts = []
+        failed = []
+        futures = {}
+        hosts = defaultdict(lambda: threading.BoundedSemaphore(self.per_host))
+        with ThreadPoolExecutor(self.workers) as executor:
+            for chunk in self.chunks(urls):
+                chunk = [url for url in dict.fromkeys(
+                    url.lower() for url in chunk) if url not in seen]
+                seen.update(chunk)
+                stored = {podcast.feed: podcast for podcast in Podcast.objects(feed__in=chunk)}
+                for url in chunk:
+                    if url in stored and stored[url].name:
+                        podcasts.append(stored[url])
+                    else:
+                        futures[executor.submit(self.fetch, url, stored.get(url),
+                                                hosts[urlparse(url).netloc])] = url
+            last = time.monotonic()
+            for future in as_completed(futures):
+                podcast = future.result()
+                if podcast:
+                    podcasts.append(podcast)
+                else:
+                    failed.append(futures[future])
+                if progress and time.monotonic() - last >= self.interval:
+                    last = time.monotonic()
+                    progress(len(podcasts) + len(failed), len(seen))
+        if podcasts:
+            now = datetime.datetime.utcnow()
+            Subscription._get_collection().bulk_write([UpdateOne(
+                {'user': user.user_id, 'podcast': podcast.id},
+                {'$setOnInsert': {'created_time': now}}, upsert=True)
+                for podcast in podcasts], ordered=False)
+            relation_cache.invalidate(('Subscription', user.user_id))
+        return podcasts, failed
+
+    def chunks(self, urls):
+        chunk = []
+        for url in urls:
+            chunk.append(url)
+            if len(chunk) == self.batch:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def fetch(self, url, podcast, host):
+        with host:
+            try:
+                podcast = podcast or Podcast.validate_feed(url)
+                result = podcast.parse_feed(conditional=False)
+                if not result:
+                    raise Exception(f'Feed not available: {url}')
+                podcast.update_feed(result, init=True)
+                return podcast
+            except Exception:
+                logger.exception(f'Failed to import {url}')
+                if podcast:
+                    podcast.delete()
+
+
+importer = OpmlImporter()
@@ -1,36 +1,39 @@
 import re
 import io
 import os
+import hashlib
 import random
 import datetime
 import requests
 from time import mktime
 import feedparser
-from mongoengine import PULL, NULLIFY
+from pymongo import UpdateOne
+from mongoengine import PULL, NULLIFY, CASCADE
 from mongoengine.document import Document, EmbeddedDocument
 from mongoengine.fields import BooleanField, DateTimeField, EmbeddedDocumentField, FileField, ImageField, IntField, ListField, ReferenceField, StringField, URLField
 from mongoengine.queryset.manager import queryset_manager
-from telegram.error import TimedOut
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton
-from castpod.utils import download
-from config import podcast_vault, dev, manifest
+from mongoengine.queryset.visitor import Q
+from castpod import network
+from castpod.vault import downloader
+from castpod.cache import user_cache, relation_cache, podcast_cache, summary_cache
+from castpod.thumbnail import thumbnails
+from castpod.normalize import normalize, preview
+from castpod.fields import CompressedTextField, compress, decompress
+from config import dev, manifest
 from telegraph import Telegraph
 from html import unescape
-from .constants import SPEAKER_MARK
-from PIL import Image
 
-telegraph = Telegraph()
-telegraph.create_account(
-    short_name=manifest.name,
-    author_name=manifest.name,
-    author_url=f'https://t.me/{manifest.bot_id}'
-)
+telegraph = Telegraph()  # signed in by connect_telegraph
+THUMB_TIMEOUT = 60  # seconds to wait for a thumbnail still being made
 
 
 class Setting(EmbeddedDocument):
     timeline_displayed = BooleanField(default=True)
     episodes_order_reversed = BooleanField(default=True)
     feed_freq = IntField(default=60)  # minutes
+    # send new episodes at once, or gather them in an hourly or daily digest
+    delivery = StringField(default='immediate', choices=(
+        'immediate', 'hourly', 'daily'))
 
 
 class Logo(EmbeddedDocument):
@@ -38,27 +41,12 @@ class Logo(EmbeddedDocument):
     is_local = BooleanField(default=False)
     url = URLField()
     file_id = StringField()
+    file_url = URLField()  # url of the artwork file_id was uploaded from
 
     @property
     def path(self):
-        if not self.is_local:
-            data = io.BytesIO(requests.get(self.url).content)
-            with Image.open(data) as im:
-                # then process image to fit restriction:
-                # 1. jpeg format
-                im = im.convert('RGB')
-                # 2. < 320*320
-                size = (80, 80)
-                im = im.resize(size, Image.ANTIALIAS)
-                # 3. less than 200 kB !!
-                im.save(self._path, "JPEG")
-                # print(os.stat(path).st_size)
-            # with open(path, 'rb') as fr:
-                # self._logo.put(fr, content_type='image/jpeg')
-                # self.save()
-        # return self._logo
-        self.is_local = True
-        return self._path
+        # usually generated at ingest, so this only waits if that is still running
+        return thumbnails.path(self.url, timeout=THUMB_TIMEOUT)
 
     @path.setter
     def path(self, value):
@@ -78,29 +66,48 @@ class User(Document):
     def validate_user(cls, from_user, subsets=None):
         if subsets:
             user = cls.objects(user_id=from_user.id).only(subsets).first()
-        else:
-            user = cls.objects(user_id=from_user.id).first()
-        return user or cls(user_id=from_user.id, username=from_user.username, name=from_user.first_name).save()
+            return user or cls(user_id=from_user.id, username=from_user.username, name=from_user.first_name).save()
+        return user_cache.get(from_user.id, lambda: (
+            cls.objects(user_id=from_user.id).first() or
+            cls(user_id=from_user.id, username=from_user.username,
+                name=from_user.first_name).save()
+        ))
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+        user_cache.invalidate(self.user_id)
+        relation_cache.invalidate(
+            ('Subscription', self.user_id), ('Star', self.user_id))
+
+    def is_subscribed(self, podcast):
+        return Subscription.exists(self, podcast)
+
+    def has_starred(self, podcast):
+        return Star.exists(self, podcast)
 
     def subscribe(self, podcast):
-        if self in podcast.subscribers:
+        if self.is_subscribed(podcast):
             return
         if not podcast.name:  # if podcast has never been initialized, ..
-            result = podcast.parse_feed()
+            result = podcast.parse_feed(conditional=False)
             if not result:
                 return
             podcast.update_feed(result, init=True)
-        podcast.update(push__subscribers=self)
+        Subscription.objects(user=self, podcast=podcast).update_one(
+            set_on_insert__created_time=datetime.datetime.utcnow(), upsert=True)
+        relation_cache.invalidate(('Subscription', self.user_id))
 
     def unsubscribe(self, podcast):
-        podcast.update(pull__subscribers=self)
-        podcast.update(pull__starrers=self)
+        Subscription.objects(user=self, podcast=podcast).delete()
+        Star.objects(user=self, podcast=podcast).delete()
+        relation_cache.invalidate(
+            ('Subscription', self.user_id), ('Star', self.user_id))
 
     def toggle_fav(self, podcast):
-        if self in podcast.starrers:
-            podcast.update(pull__starrers=self)
-        else:
-            podcast.update(push__starrers=self)
+        if not Star.objects(user=self, podcast=podcast).delete():
+            Star.objects(user=self, podcast=podcast).update_one(
+                set_on_insert__created_time=datetime.datetime.utcnow(), upsert=True)
+        relation_cache.invalidate(('Star', self.user_id))
 
     def fav_ep(self, episode):
         episode.update(push__starrers=self)
@@ -112,17 +119,22 @@ class User(Document):
 class Episode(Document):
     from_podcast = ReferenceField('Podcast')  # reverse delete rule = ??? !!!
     title = StringField(unique=True)
+    guid = StringField()  # item guid, or enclosure url if the feed has none
+    number = IntField()  # 1 for the first episode stored of the podcast
     link = StringField()
     subtitle = StringField()
-    summary = StringField()
+    summary = CompressedTextField()  # plain text of the shownotes
+    preview = StringField()  # start of the summary, for display
     host = StringField()
     published_time = DateTimeField()
     updated_time = DateTimeField()
     message_id = IntField()  # message_id in podcast_vault
     file_id = StringField()
-    shownotes = StringField()
+    shownotes = CompressedTextField()
     _shownotes_url = URLField()
-    _timeline = StringField()
+    shownotes_path = StringField()  # of the Telegraph page
+    shownotes_hash = StringField()  # of the published title and shownotes
+    _timeline = StringField()  # lines of the shownotes with a timestamp
     is_downloaded = BooleanField(required=True, default=True)
     url = StringField()
     performer = StringField()
@@ -131,6 +143,16 @@ class Episode(Document):
     duration = IntField()
     starrers = ListField(ReferenceField(User, reverse_delete_rule=PULL))
 
+    meta = {'indexes': [
+        ('from_podcast', 'guid'),
+        ('from_podcast', '-published_time'),
+        'starrers',
+        ('shownotes_hash', '-published_time'),  # None for the shownotes not published yet
+        # partial, as episodes stored before numbering are numbered by migrate_episodes
+        {'fields': ['from_podcast', '-number'], 'unique': True,
+         'partialFilterExpression': {'number': {'$exists': True}}}
+    ]}
+
     @property
     def logo(self):
         if not self._logo:
@@ -143,40 +165,21 @@ class Episode(Document):
 
     @property
     def shownotes_url(self):
-        if not self._shownotes_url:
-            res = telegraph.create_page(
-                title=f"{self.title}",
-                html_content=self.shownotes,
-                author_name=self.from_podcast.name
-            )
-            self._shownotes_url = f"https://telegra.ph/{res['path']}"
+        # None until published by castpod.shownotes
         return self._shownotes_url
 
     def set_content(self, logo_url):
-        img_content = f"<img src='{logo_url}'>" if logo_url and (
-            'img' not in self.shownotes) else ''
-        self.shownotes = img_content + \
-            self.replace_invalid_tags(self.shownotes)
+        content = normalize(self.shownotes, logo_url)
+        self.shownotes, self._timeline, self.summary = content
+        self.preview = preview(content.summary)
         return self.shownotes
 
     @property
     def timeline(self):
-        if not self._timeline:
-            shownotes = re.sub(r'</?(?:br|p|li).*?>', '\n', self.shownotes)
-            pattern = r'.+(?:[0-9]{1,2}[:：\'])?[0-9]{1,3}[:：\'][0-5][0-9].+'
-            matches = re.finditer(pattern, shownotes)
-            self._timeline = '\n\n'.join([re.sub(
-                r'</?(?:cite|del|span|div|s).*?>', '', match[0].lstrip()) for match in matches])
+        if self._timeline is None:  # stored before set_content kept it
+            self._timeline = normalize(self.shownotes).timeline
         return self._timeline
 
-    def replace_invalid_tags(self, html_content):
-        #!!!
-        html_content = html_content.replace('h1', 'h3').replace('h2', 'h4')
-        html_content = html_content.replace('cite>', "i>")
-        html_content = re.sub(r'</?(?:div|span|audio).*?>', '', html_content)
-        html_content = html_content.replace('’', "'")
-        return html_content
-
 
 class Podcast(Document):
     # meta = {'queryset_class': PodcastQuerySet}
@@ -190,17 +193,25 @@ class Podcast(Document):
     group = IntField()  # 播客绑定的群组
     # 认证的主播，telegram 管理员
     admin = ReferenceField(User, reverse_delete_rule=NULLIFY)
-    episodes = ListField(ReferenceField(Episode, reverse_delete_rule=PULL))
-    subscribers = ListField(ReferenceField(User, reverse_delete_rule=PULL))
-    starrers = ListField(ReferenceField(User, reverse_delete_rule=PULL))
     _updated_time = DateTimeField(default=datetime.datetime(1970, 1, 1))
-
-    meta = {'indexes': [
-        {'fields': ['$name', "$host"],
-         'default_language': 'english',
-         'weights': {'name': 10, 'host': 2}
-         }
-    ]}
+    # validators of the last fetched feed, used for conditional requests
+    etag = StringField()
+    last_modified = StringField()
+    content_hash = StringField()  # for servers that send neither of above
+
+    meta = {
+        'indexes': [
+            {'fields': ['$name', "$host"],
+             'default_language': 'english',
+             'weights': {'name': 10, 'host': 2}
+             },
+            '-_updated_time',
+            # for the nullify when a user is deleted
+            {'fields': ['admin'], 'sparse': True}
+        ],
+        # documents keep `subscribers`, `starrers` and `episodes` until they are migrated
+        'strict': False
+    }
 
     @property
     def updated_time(self):
@@ -227,29 +238,103 @@ class Podcast(Document):
 
     @queryset_manager
     def subscribe_by(doc_cls, queryset, user, subsets=None):
+        queryset = queryset(id__in=Subscription.podcast_ids(user))
         if subsets:
-            return queryset(subscribers=user).only(subsets)
+            return queryset.only(subsets)
         else:
-            return queryset(subscribers=user)
+            return queryset
 
     @queryset_manager
     def star_by(doc_cls, queryset, user, subsets=None):
+        queryset = queryset(id__in=Star.podcast_ids(user))
         if subsets:
-            return queryset(starrers=user).only(subsets)
+            return queryset.only(subsets)
         else:
-            return queryset(starrers=user)
+            return queryset
+
+    @property
+    def episode_count(self):
+        # numbers have no gaps, so the latest one is the count
+        latest = Episode.objects(from_podcast=self).order_by(
+            '-number').only('number').first()
+        return latest.number if latest else 0
+
+    def episode(self, number):
+        return Episode.objects(from_podcast=self, number=number).first()
+
+    def episodes(self, first=None, last=None):
+        """Episodes numbered from `first` to `last`, the latest first, without their texts."""
+        episodes = Episode.objects(from_podcast=self).exclude('shownotes', 'summary')
+        if first is not None:
+            episodes = episodes(number__gte=first)
+        if last is not None:
+            episodes = episodes(number__lte=last)
+        return episodes.order_by('-number')
+
+    def search_episodes(self, keyword):
+        """Episodes with `keyword` in their title, or else in their summary, the latest first."""
+        episodes = Episode.objects(
+            from_podcast=self, title__icontains=keyword).order_by('-published_time')
+        if episodes:
+            return episodes
+        # summaries are compressed, so they are matched here rather than in mongo,
+        # decompressed once for all the keystrokes of a search
+        summaries = summary_cache.get(self.id, lambda: [
+            (episode.id, (episode.summary or '').lower())
+            for episode in Episode.objects(from_podcast=self).only('summary')])
+        keyword = keyword.lower()
+        ids = [episode_id for episode_id, summary in summaries if keyword in summary]
+        return Episode.objects(id__in=ids).order_by('-published_time')
 
-    def parse_feed(self):
+    @property
+    def subscriber_count(self):
+        return Subscription.objects(podcast=self).count()
+
+    def min_feed_freq(self):
+        """The shortest feed_freq of the subscribers, None if there are none."""
+        result = list(Subscription.objects(podcast=self).aggregate([
+            {'$lookup': {'from': User._get_collection_name(), 'localField': 'user',
+                         'foreignField': '_id', 'as': 'user'}},
+            {'$unwind': '$user'},
+            {'$group': {'_id': None, 'freq': {'$min': {'$ifNull': [
+                '$user.settings.feed_freq', Setting.feed_freq.default]}}}}
+        ]))
+        return result[0]['freq'] if result else None
+
+    def iter_subscribers(self, subsets=('user_id', 'settings'), batch=1000):
+        """Yield the subscribed users, `batch` of them per query."""
+        user_ids = []
+        for subscription in Subscription.objects(podcast=self).only('user').as_pymongo().batch_size(batch):
+            user_ids.append(subscription['user'])
+            if len(user_ids) == batch:
+                yield from User.objects(user_id__in=user_ids).only(*subsets)
+                user_ids = []
+        if user_ids:
+            yield from User.objects(user_id__in=user_ids).only(*subsets)
+
+    def parse_feed(self, conditional=True):
         # Do request using requests library and timeout
         # ！！！
+        headers = {}
+        if conditional:
+            if self.etag:
+                headers['If-None-Match'] = self.etag
+            if self.last_modified:
+                headers['If-Modified-Since'] = self.last_modified
         try:
-            res = requests.get(self.feed, timeout=5.0)
+            res = network.get(self.feed, 'feed', headers=headers,
+                              timeout=(network.CONNECT_TIMEOUT, 5.0))
             res.raise_for_status()
         except requests.ReadTimeout:
             raise Exception(f'网络连接超时！')
         except requests.exceptions.HTTPError as e:
             self.delete()
             raise Exception(f'Feed open error, status: {res.status_code}')
+        if res.status_code == 304:  # not modified
+            return
+        content_hash = hashlib.sha1(res.content).hexdigest()
+        if conditional and content_hash == self.content_hash:
+            return
         content = io.BytesIO(res.content)
         result = feedparser.parse(content)
         if not result.entries:
@@ -257,58 +342,45 @@ class Podcast(Document):
             raise Exception(f'Feed has no entries.')
         self.updated_time = result.feed.get(
             'updated_parsed') or result.entries[0].get('updated_parsed')
-        self.save()
+        self.etag = res.headers.get('ETag')
+        self.last_modified = res.headers.get('Last-Modified')
+        self.content_hash = content_hash
+        # stored by update_feed once the items are, so a failed ingest is retried
         return result
 
-    def check_update(self, context):
+    def refresh_feed(self, context):
+        """Fetch the feed and ingest new items, returns False if the feed is unchanged."""
+        if not self.name:  # its back catalogue is ingested by update_feed(init=True)
+            return False
         last_updated_time = self.updated_time
         result = self.parse_feed()
         if not result:
-            return
+            return False
         # context.bot.send_message(
         #     dev, f"{self.name}\n上次更新 {str(last_updated_time)}\n最近更新 {str(self.updated_time)}")
         if last_updated_time < self.updated_time:
             context.bot.send_message(dev, f'{self.name} 检测到更新,更新中…')
-            self.update_feed(result, init=False)
         # else:
             # context.bot.send_message(dev, f'{self.name} 未检测到更新')
-        for episode in self.episodes:
-            if episode.is_downloaded:
-                continue
-            context.bot.send_message(
-                dev, f'开始下载：{self.name} - {episode.title}')
-            try:
-                audio = download(episode, context)
-                message = context.bot.send_audio(
-                    chat_id=f'@{podcast_vault}',
-                    audio=audio,
-                    caption=(
-                        f"{SPEAKER_MARK} *{self.name}*\n\n"
-                        f"#{self.id}"
-                    ),
-                    reply_markup=InlineKeyboardMarkup.from_row(
-                        [InlineKeyboardButton('订阅', url=f'https://t.me/{manifest.bot_id}?start=p{self.id}'),
-                         InlineKeyboardButton('相关链接', url=episode.shownotes_url)]
-                    ),
-                    title=episode.title,
-                    performer=self.name,
-                    duration=episode.duration,
-                    thumb=episode.logo.path
-                )
-                episode.is_downloaded = True
-                episode.message_id = message.message_id
-                episode.file_id = message.audio.file_id
-                episode.save()
-                return message
-            except TimedOut as e:
-                context.bot.send_message(dev, '下载超时！')
-                pass
-            except Exception as e:
-                context.bot.send_message(dev, f'{e}')
+        # items can be added or back-dated without touching the updated time
+        self.update_feed(result, init=False)
+        return True
+
+    def queue_episodes(self, bot, deliver):
+        """Hand episodes not delivered yet to the download pipeline, returns how many."""
+        # feed may be unchanged, but episodes failed last time are retried:
+        count = 0
+        for episode in Episode.objects(from_podcast=self, is_downloaded=False).order_by('-published_time'):
+            if downloader.pending(episode):
                 continue
+            bot.send_message(dev, f'开始下载：{self.name} - {episode.title}')
+            downloader.request(bot, episode, self, waiter=deliver)
+            count += 1
+        return count
 
     def update_feed(self, result, init):
         feed = result.feed
+        podcast_cache.invalidate(self.id)
         if not feed.get('title'):
             self.delete()
             raise Exception("Cannot parse feed name.")
@@ -316,7 +388,6 @@ class Podcast(Document):
         if len(self.name) == 63:
             self.name += '…'
         self.logo.url = feed['image']['href']
-        self.save()
 
         if feed.get('author_detail'):
             self.host = unescape(feed.author_detail.get('name') or '')
@@ -329,29 +400,66 @@ class Podcast(Document):
             self.email = feed.author_detail.get('email') or ''
         else:
             self.email = ''
-        for item in result['items']:
-            episode = self.parse_episode(init, item)
-            if episode:
-                self.update(push__episodes=episode)
-                self.save()
-            elif not init:  # 一旦发现没有更新，就停止检测
-                break
-        self.reload()
-        sorted_episodes = sorted(
-            self.episodes, key=lambda x: x.published_time, reverse=True)
-        self.update(set__episodes=sorted_episodes)
-        self.save()
+        items = result['items'] if init else self.new_items(result['items'])
+        episodes = [self.parse_episode(init, item) for item in items]
+        episodes = sorted(filter(None, episodes),
+                          key=lambda x: x.published_time, reverse=True)
+        kwargs = {
+            'set__name': self.name,
+            'set___logo': self.logo,
+            'set__host': self.host,
+            'set__website': self.website,
+            'set__email': self.email,
+            'set___updated_time': self._updated_time,
+            'set__etag': self.etag,
+            'set__last_modified': self.last_modified,
+            'set__content_hash': self.content_hash
+        }
+        if episodes:
+            # numbers follow the order episodes are stored in, so they never
+            # change, even for back-dated items
+            count = self.episode_count
+            for number, episode in enumerate(reversed(episodes), count + 1):
+                episode.number = number
+            Episode.objects.insert(episodes, load_bulk=False)
+            summary_cache.invalidate(self.id)
+        # thumbnails are ready by the time the episodes are uploaded
+        for url in {self.logo.url} | {episode.logo.url for episode in episodes}:
+            if url:
+                thumbnails.submit(url)
+        self.update(**kwargs)
+        self._clear_changed_fields()
+
+    @staticmethod
+    def item_guid(item):
+        return item.get('id') or item.enclosures[0].get('href')
+
+    def new_items(self, items, batch=200):
+        """Yield the feed items whose guid is not stored yet.
+
+        The whole feed is checked, `batch` items per indexed lookup, so items
+        that are back-dated or listed out of order are found too.
+        """
+        items = [item for item in items if item.get('enclosures')]
+        for start in range(0, len(items), batch):
+            chunk = items[start:start+batch]
+            guids = [self.item_guid(item) for item in chunk]
+            urls = [item.enclosures[0].get('href') for item in chunk]
+            known = set()
+            # episodes stored before guids were recorded are matched by url
+            for episode in Episode.objects(
+                Q(from_podcast=self) & (Q(guid__in=guids) | Q(url__in=urls))
+            ).only('guid', 'url'):
+                known.update([episode.guid, episode.url])
+            for item, guid, url in zip(chunk, guids, urls):
+                if guid not in known and url not in known:
+                    yield item
 
     def parse_episode(self, init, item):
-        published_time = datetime.datetime.fromtimestamp(
-            mktime(item.published_parsed))
-
         if not item.get('enclosures'):
             return
 
         if not init:
-            if (published_time <= self.episodes[0].published_time):
-                return
             episode = Episode(is_downloaded=False)
         else:
             episode = Episode()
@@ -365,6 +473,7 @@ class Podcast(Document):
                 size = match[1]
 
         episode.from_podcast = self
+        episode.guid = self.item_guid(item)
         episode.url = audio.get('href')
         episode.size = int(size)
         episode.performer = self.name
@@ -376,16 +485,14 @@ class Podcast(Document):
         episode.subtitle = unescape(item.get('subtitle') or '')
         if episode.title == episode.subtitle:
             episode.subtitle = ''
-        episode.summary = unescape(item.get('summary') or '')
         episode.shownotes = item.get('content')[0]['value'] if item.get(
-            'content') else episode.summary
+            'content') else item.get('summary') or ''
         episode.set_content(episode.logo.url)
         episode.published_time = datetime.datetime.fromtimestamp(
             mktime(item.published_parsed))
         episode.updated_time = datetime.datetime.fromtimestamp(
             mktime(item.updated_parsed))
-        episode.save()
-        self.save()
+        episode.validate()
         return episode
 
     def set_duration(self, duration: str) -> int:
@@ -410,3 +517,151 @@ class Podcast(Document):
         else:
             duration_timedelta = 0
         return int(duration_timedelta)
+
+
+class Subscription(Document):
+    user = ReferenceField(User, required=True, reverse_delete_rule=CASCADE)
+    podcast = ReferenceField(
+        Podcast, required=True, reverse_delete_rule=CASCADE)
+    created_time = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {'indexes': [
+        {'fields': ['user', 'podcast'], 'unique': True},
+        ['podcast', 'user']
+    ]}
+
+    @classmethod
+    def exists(cls, user, podcast):
+        return cls.objects(user=user, podcast=podcast).only('id').first() is not None
+
+    @classmethod
+    def podcast_ids(cls, user):
+        return relation_cache.get((cls.__name__, user.user_id), lambda: [
+            doc['podcast'] for doc in cls.objects(user=user).only('podcast').as_pymongo()])
+
+
+class Star(Document):
+    user = ReferenceField(User, required=True, reverse_delete_rule=CASCADE)
+    podcast = ReferenceField(
+        Podcast, required=True, reverse_delete_rule=CASCADE)
+    created_time = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {'indexes': [
+        {'fields': ['user', 'podcast'], 'unique': True},
+        ['podcast', 'user']
+    ]}
+
+    @classmethod
+    def exists(cls, user, podcast):
+        return cls.objects(user=user, podcast=podcast).only('id').first() is not None
+
+    @classmethod
+    def podcast_ids(cls, user):
+        return relation_cache.get((cls.__name__, user.user_id), lambda: [
+            doc['podcast'] for doc in cls.objects(user=user).only('podcast').as_pymongo()])
+
+
+def migrate_subscriptions():
+    """Move the `subscribers` and `starrers` arrays of podcasts into their own collections."""
+    podcasts = Podcast._get_collection()
+    for cls, field in ((Subscription, 'subscribers'), (Star, 'starrers')):
+        collection = cls._get_collection()
+        for doc in podcasts.find({field: {'$exists': True}}, {field: 1}):
+            now = datetime.datetime.utcnow()
+            if doc[field]:
+                collection.bulk_write([UpdateOne(
+                    {'user': user_id, 'podcast': doc['_id']},
+                    {'$setOnInsert': {'created_time': now}}, upsert=True)
+                    for user_id in doc[field]], ordered=False)
+            podcasts.update_one({'_id': doc['_id']}, {'$unset': {field: ''}})
+
+
+def migrate_episodes():
+    """Number the episodes in the order of the `episodes` arrays of podcasts, then drop them."""
+    podcasts = Podcast._get_collection()
+    episodes = Episode._get_collection()
+    for doc in podcasts.find({'episodes': {'$exists': True}}, {'episodes': 1}):
+        if doc['episodes']:
+            episodes.bulk_write([UpdateOne(
+                {'_id': episode_id}, {'$set': {'number': len(doc['episodes']) - position}})
+                for position, episode_id in enumerate(doc['episodes'])], ordered=False)
+        podcasts.update_one({'_id': doc['_id']}, {'$unset': {'episodes': ''}})
+
+
+def migrate_episode_texts(batch=500):
+    """Compress the shownotes and summaries stored as strings, and fill their previews and timelines."""
+    episodes = Episode._get_collection()
+    pending = episodes.find({'$or': [{'shownotes': {'$type': 'string'}}, {'summary': {'$type': 'string'}},
+                                     {'_timeline': {'$exists': False}}]},
+                            {'shownotes': 1, 'summary': 1, '_timeline': 1})
+    updates = []
+    for doc in pending:
+        fields = {}
+        shownotes = decompress(doc.get('shownotes'))
+        content = normalize(shownotes) if shownotes else None
+        if isinstance(doc.get('shownotes'), str):
+            fields['shownotes'] = compress(doc['shownotes'])
+        if isinstance(doc.get('summary'), str):
+            # html before set_content kept the plain text of the shownotes, as it does now
+            summary = content.summary if content else normalize(doc['summary']).summary
+            fields['summary'] = compress(summary)
+            fields['preview'] = preview(summary)
+        if '_timeline' not in doc:  # derived on every load until stored
+            fields['_timeline'] = content.timeline if content else ''
+        updates.append(UpdateOne({'_id': doc['_id']}, {'$set': fields}))
+        if len(updates) == batch:
+            episodes.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        episodes.bulk_write(updates, ordered=False)
+
+
+def migrate_logos():
+    """Record the artwork of logos uploaded before file_url was kept, as their own url."""
+    podcasts = Podcast._get_collection()
+    updates = [UpdateOne({'_id': doc['_id']}, {'$set': {'_logo.file_url': doc['_logo'].get('url')}})
+               for doc in podcasts.find({'_logo.file_id': {'$exists': True, '$ne': None},
+                                         '_logo.file_url': {'$exists': False}}, {'_logo': 1})]
+    if updates:
+        podcasts.bulk_write(updates, ordered=False)
+
+
+class TelegraphAccount(Document):
+    """The Telegraph account of the bot, only the account that created a page can edit it."""
+    short_name = StringField(required=True, unique=True)
+    access_token = StringField(required=True)
+
+
+def connect_telegraph():
+    """Sign `telegraph` in with the stored account, creating it on the first run."""
+    account = TelegraphAccount.objects(short_name=manifest.name).first()
+    if account:
+        telegraph._telegraph.access_token = account.access_token
+        return
+    token = telegraph.create_account(
+        short_name=manifest.name,
+        author_name=manifest.name,
+        author_url=f'https://t.me/{manifest.bot_id}'
+    )['access_token']
+    TelegraphAccount(short_name=manifest.name, access_token=token).save()
+
+
+class Delivery(Document):
+    """A new episode to be copied from podcast_vault to one subscriber, or listed in a digest."""
+    user_id = IntField(required=True)
+    podcast = ReferenceField(Podcast, reverse_delete_rule=CASCADE)
+    episode = ReferenceField(Episode, reverse_delete_rule=CASCADE)
+    message_id = IntField(required=True)  # message_id in podcast_vault
+    status = StringField(default='pending', choices=(
+        'pending', 'digest', 'sent', 'failed'))
+    attempts = IntField(default=0)
+    error = StringField()
+    due_time = DateTimeField(default=datetime.datetime.utcnow)
+    sent_time = DateTimeField()
+
+    meta = {'indexes': [
+        {'fields': ['episode', 'user_id'], 'unique': True},
+        ('status', 'due_time'),
+        ('user_id', 'status', 'due_time'),  # digest of one user
+        'podcast'  # for the cascade when a podcast is deleted
+    ]}
@@ -0,0 +1,145 @@
+import time
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from config import manifest
+
+CONNECT_TIMEOUT = 5.0  # seconds
+READ_TIMEOUT = 30.0
+POOL_HOSTS = 64  # hosts whose connections are kept alive
+PER_HOST = 4  # requests in flight per host, further ones wait for a free slot
+POOL_TIMEOUT = 60.0  # seconds to wait for a free slot before giving up
+
+
+class CallStats(object):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = 0.0  # seconds in total, until the headers arrive for streams
+
+    def __str__(self):
+        average = self.latency / self.requests * 1000 if self.requests else 0
+        return (
+            f'{self.requests} 次请求，{self.errors} 次失败，'
+            f'{self.bytes / 1048576:.1f} MB，平均 {average:.0f} ms'
+        )
+
+
+class HttpStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = {}
+
+    def record(self, site, nbytes=0, latency=None, error=False):
+        with self.lock:
+            stats = self.sites.setdefault(site, CallStats())
+            if latency is not None:
+                stats.requests += 1
+                stats.latency += latency
+            stats.errors += error
+            stats.bytes += nbytes
+
+    def __str__(self):
+        with self.lock:
+            return '\n'.join(f'`{site}` {stats}' for site, stats in sorted(self.sites.items()))
+
+
+class HostLimits(object):
+    """At most `per_host` requests in flight per host.
+
+    A slot is taken before sending, and given back once the body is read, or
+    for streams when the response is closed. A response left open costs its
+    slot until then, so waits are bounded by `timeout` rather than hanging.
+    """
+
+    def __init__(self, per_host, timeout):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.slots = {}  # host -> semaphore
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            slots = self.slots.setdefault(
+                host, threading.BoundedSemaphore(self.per_host))
+        if not slots.acquire(timeout=self.timeout):
+            raise requests.ConnectionError(f'No free connection to {host}')
+        return slots
+
+
+stats = HttpStats()
+limits = HostLimits(PER_HOST, POOL_TIMEOUT)
+session = requests.Session()
+session.headers['User-Agent'] = f'{manifest.name}/{manifest.version} (+{manifest.repo})'
+# requests per host are capped by `limits`, the pool only keeps connections alive
+adapter = HTTPAdapter(pool_connections=POOL_HOSTS,
+                      pool_maxsize=PER_HOST, pool_block=False)
+session.mount('http://', adapter)
+session.mount('https://', adapter)
+
+
+def request(method, url, site, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs):
+    """Send a request with the shared session, accounted to the `site` it is called from.
+
+    With `stream=True` only the latency is recorded here, read the body with
+    `iter_content` to count its bytes, and close the response to return its
+    connection to the pool.
+    """
+    slots = limits.acquire(url)
+    start = time.monotonic()
+    try:
+        res = session.request(method, url, timeout=timeout, **kwargs)
+        nbytes = 0 if kwargs.get('stream') else len(res.content)
+    except Exception:
+        slots.release()
+        stats.record(site, latency=time.monotonic() - start, error=True)
+        raise
+    stats.record(site, nbytes, time.monotonic() - start, error=not res.ok)
+    if kwargs.get('stream'):
+        close = res.close
+
+        def release():
+            res.close = close  # released once, however often it is closed
+            try:
+                close()
+            finally:
+                slots.release()
+        res.close = release
+    else:
+        slots.release()
+    return res
+
+
+def get(url, site, **kwargs):
+    return request('GET', url, site, **kwargs)
+
+
+def head(url, site, **kwargs):
+    return request('HEAD', url, site, **kwargs)
+
+
+def post(url, site, **kwargs):
+    return request('POST', url, site, **kwargs)
+
+
+def iter_content(res, site, chunk_size):
+    for chunk in res.iter_content(chunk_size):
+        stats.record(site, len(chunk))
+        yield chunk
+
+
+def iter_adaptive(res, site, min_size=16384, max_size=1048576, target=0.1):
+    """Read a streamed body in chunks of about `target` seconds at the current throughput."""
+    size = 65536
+    while True:
+        start = time.monotonic()
+        chunk = res.raw.read(size, decode_content=True)
+        if not chunk:
+            return
+        rate = len(chunk) / max(time.monotonic() - start, 0.001)
+        size = min(max(int(rate * target), min_size), max_size)
+        stats.record(site, len(chunk))
+        yield chunk
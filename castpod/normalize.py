@@ -0,0 +1,171 @@
+import re
+from html import escape
+from html.parser import HTMLParser
+from collections import namedtuple
+
+Content = namedtuple('Content', ['shownotes', 'timeline', 'summary'])
+
+# tags of Telegraph pages, others are renamed or unwrapped
+TELEGRAPH_TAGS = {
+    'a', 'aside', 'b', 'blockquote', 'br', 'code', 'em', 'figcaption', 'figure', 'h3', 'h4',
+    'hr', 'i', 'iframe', 'img', 'li', 'ol', 'p', 'pre', 's', 'strong', 'u', 'ul', 'video'
+}
+RENAMED_TAGS = {
+    'h1': 'h3', 'h2': 'h4', 'h5': 'h4', 'h6': 'h4',
+    'cite': 'i', 'del': 's', 'strike': 's', 'ins': 'u'
+}
+KEPT_ATTRS = {'a': ('href',), 'img': ('src',), 'iframe': ('src',), 'video': ('src',)}
+VOID_TAGS = {'br', 'hr', 'img'}
+# tags closed by the start of another one, unless a tag in between scopes them
+IMPLIED_ENDS = {'p': {'p'}, 'li': {'li', 'p'}, 'h3': {'p'}, 'h4': {'p'}}
+SCOPES = {'ul', 'ol', 'blockquote', 'aside', 'figure'}
+SKIPPED_TAGS = {'script', 'style', 'template', 'audio'}  # dropped with their content
+# tags that end a line of the timeline and of the summary
+LINE_TAGS = {
+    'br', 'p', 'li', 'div', 'blockquote', 'hr', 'tr', 'ul', 'ol', 'pre',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6'
+}
+# tags of Telegram captions kept in the timeline
+TIMELINE_TAGS = {'a', 'b', 'strong', 'i', 'em', 'u', 'code'}
+TIMESTAMP = re.compile(r"(?:[0-9]{1,2}[:：'])?[0-9]{1,3}[:：'][0-5][0-9]")
+SPACES = re.compile(r'\s+')
+PREVIEW_LENGTH = 100  # about two lines of an inline result
+
+
+class ShownotesParser(HTMLParser):
+    """Sanitize shownotes for Telegraph while collecting their timeline and text.
+
+    Tags are balanced: tags left open are closed by the end tag of a tag
+    around them or at the end, and end tags of tags not open are dropped.
+
+    Lines are split on line tags and newlines. A line with a timestamp and
+    some text besides it is a line of the timeline, which keeps the inline
+    tags Telegram captions understand.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.shownotes = []
+        self.timeline = []
+        self.summary = []
+        self.line = []  # markup of the current line
+        self.line_text = []
+        self.line_tags = []  # inline tags open in the current line
+        self.open_tags = []  # tags open in the shownotes
+        self.skipping = 0
+        self.has_image = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+            return
+        if self.skipping:
+            return
+        if tag in LINE_TAGS:
+            self.end_line()
+        name = RENAMED_TAGS.get(tag, tag)
+        if name not in TELEGRAPH_TAGS:
+            return
+        implied = None  # the outermost tag this one ends
+        for open_tag in reversed(self.open_tags):
+            if open_tag in SCOPES:
+                break
+            if open_tag in IMPLIED_ENDS.get(name, ()):
+                implied = open_tag
+        if implied:
+            self.close_tags(implied)
+        kept = ''.join(f' {key}="{escape(value)}"' for key, value in attrs
+                       if key in KEPT_ATTRS.get(name, ()) and value)
+        self.shownotes.append(f'<{name}{kept}>')
+        if name not in VOID_TAGS:
+            self.open_tags.append(name)
+        if name == 'img':
+            self.has_image = True
+        if name in TIMELINE_TAGS:
+            self.line.append(f'<{name}{kept}>')
+            self.line_tags.append(name)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(self.skipping - 1, 0)
+            return
+        if self.skipping or tag in VOID_TAGS:
+            return
+        name = RENAMED_TAGS.get(tag, tag)
+        if name in self.open_tags:  # end tags never opened are dropped
+            self.close_tags(name)
+        if name in self.line_tags:
+            while self.line_tags:
+                open_tag = self.line_tags.pop()
+                self.line.append(f'</{open_tag}>')
+                if open_tag == name:
+                    break
+        if tag in LINE_TAGS:
+            self.end_line()
+
+    def close_tags(self, name):
+        """Close `name` and the tags left open inside it."""
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.shownotes.append(f'</{open_tag}>')
+            if open_tag == name:
+                return
+
+    def handle_data(self, data):
+        if self.skipping:
+            return
+        data = data.replace('’', "'")
+        self.shownotes.append(escape(data, quote=False))
+        first, *rest = data.split('\n')
+        self.add_text(first)
+        for text in rest:
+            self.end_line()
+            self.add_text(text)
+
+    def add_text(self, text):
+        if text:
+            self.line.append(escape(text, quote=False))
+            self.line_text.append(text)
+
+    def end_line(self):
+        text = SPACES.sub(' ', ''.join(self.line_text)).strip()
+        if text:
+            self.summary.append(text)
+            match = TIMESTAMP.search(text)
+            if match and text != match[0]:
+                self.line.extend(f'</{tag}>' for tag in reversed(self.line_tags))
+                self.timeline.append(''.join(self.line).strip())
+        self.line = []
+        self.line_text = []
+        self.line_tags = []
+
+    def close(self):
+        super().close()
+        self.end_line()
+        while self.open_tags:
+            self.shownotes.append(f'</{self.open_tags.pop()}>')
+
+
+def normalize(html, logo_url=None):
+    """Return the sanitized shownotes, the timeline and the plain text of `html`.
+
+    The logo is put in front of shownotes that have no image of their own.
+    """
+    parser = ShownotesParser()
+    parser.feed(html or '')
+    parser.close()
+    shownotes = ''.join(parser.shownotes)
+    if logo_url and not parser.has_image:
+        shownotes = f'<img src="{escape(logo_url)}">' + shownotes
+    return Content(shownotes, '\n\n'.join(parser.timeline), '\n'.join(parser.summary))
+
+
+def preview(summary, length=PREVIEW_LENGTH):
+    """The start of `summary` on one line, cut to `length` characters."""
+    text = SPACES.sub(' ', summary or '').strip()
+    return text if len(text) <= length else text[:length - 1] + '…'
@@ -0,0 +1,77 @@
+import re
+from bson import ObjectId
+from .models import Podcast, Episode, Subscription, Star
+from .cache import podcast_cache
+
+
+class PodcastCard(object):
+    """Fields of a podcast shown on pages and inline results.
+
+    Read straight from the raw document with a projection, which skips
+    building a Document, its embedded Logo and its change tracking for
+    every podcast of a list.
+    """
+    __slots__ = ('id', 'name', 'host', 'email', 'logo_url', 'logo_file_id')
+    projection = {'name': 1, 'host': 1, 'email': 1,
+                  '_logo.url': 1, '_logo.file_id': 1}
+
+    def __init__(self, doc):
+        logo = doc.get('_logo') or {}
+        self.id = doc['_id']
+        self.name = doc.get('name')
+        self.host = doc.get('host')
+        self.email = doc.get('email')
+        self.logo_url = logo.get('url')
+        self.logo_file_id = logo.get('file_id')
+
+
+def podcast_cards(query, sort=None):
+    cursor = Podcast._get_collection().find(query, PodcastCard.projection)
+    if sort:
+        cursor = cursor.sort(sort)
+    return [PodcastCard(doc) for doc in cursor]
+
+
+def podcast_card(podcast_id):
+    podcast_id = ObjectId(podcast_id)
+
+    def load():
+        cards = podcast_cards({'_id': podcast_id})
+        return cards[0] if cards else None
+    return podcast_cache.get(podcast_id, load)
+
+
+def subscribed_cards(user, keywords=None, sort=None):
+    query = {'_id': {'$in': Subscription.podcast_ids(user)}}
+    if keywords:
+        query['name'] = {'$regex': re.escape(keywords), '$options': 'i'}
+    return podcast_cards(query, sort)
+
+
+def starred_cards(user):
+    return podcast_cards({'_id': {'$in': Star.podcast_ids(user)}})
+
+
+class EpisodeCard(object):
+    """Fields of an episode listed in inline results, with the card of its podcast."""
+    __slots__ = ('id', 'title', 'logo_url', 'podcast')
+    projection = {'title': 1, 'from_podcast': 1, '_logo.url': 1}
+
+    def __init__(self, doc, podcast):
+        self.id = doc['_id']
+        self.title = doc.get('title')
+        self.logo_url = (doc.get('_logo') or {}).get('url')
+        self.podcast = podcast
+
+
+def search_subscribed_episodes(user, keywords):
+    """Episodes of the podcasts `user` subscribes to whose title has `keywords`."""
+    docs = list(Episode._get_collection().find({
+        'from_podcast': {'$in': Subscription.podcast_ids(user)},
+        'title': {'$regex': re.escape(keywords), '$options': 'i'}
+    }, EpisodeCard.projection))
+    # one query for the podcasts of all episodes, instead of one per episode
+    podcasts = {card.id: card for card in podcast_cards(
+        {'_id': {'$in': list({doc['from_podcast'] for doc in docs})}})}
+    return [EpisodeCard(doc, podcasts[doc['from_podcast']])
+            for doc in docs if doc['from_podcast'] in podcasts]
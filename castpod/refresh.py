@@ -0,0 +1,156 @@
+import time
+import heapq
+import logging
+import threading
+from statistics import median
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
+from .models import Podcast, Episode
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshReport(object):
+    def __init__(self):
+        self.fetched = 0  # feed changed and was parsed
+        self.skipped = 0  # feed not modified
+        self.failed = 0
+        self.deferred = []  # podcasts left over when the time budget ran out
+        self.queued = 0  # episodes handed to the download pipeline
+        self.elapsed = 0.0
+
+    def __str__(self):
+        return (
+            f'fetched {self.fetched}, skipped {self.skipped}, '
+            f'failed {self.failed}, deferred {len(self.deferred)}, '
+            f'{self.queued} episodes queued '
+            f'in {self.elapsed:.1f}s'
+        )
+
+
+class FeedRefresher(object):
+    """Refresh podcasts with a bounded pool of worker threads.
+
+    At most `per_host` feeds of the same host are fetched at a time, and
+    no new feed is started once `budget` seconds have passed.
+    """
+
+    def __init__(self, workers=8, per_host=2, budget=1000):
+        self.workers = workers
+        self.per_host = per_host
+        self.budget = budget
+
+    def run(self, podcasts, context, deliver):
+        """Refresh `podcasts`, `deliver` is called with each finished download job."""
+        report = RefreshReport()
+        queues = OrderedDict()  # host -> deque of podcasts
+        for podcast in podcasts:
+            queues.setdefault(urlparse(podcast.feed).netloc,
+                              deque()).append(podcast)
+        active = {host: 0 for host in queues}
+        condition = threading.Condition()
+        start = time.monotonic()
+        deadline = start + self.budget
+
+        def next_podcast():
+            with condition:
+                while queues:
+                    if time.monotonic() > deadline:
+                        return None, None
+                    for host, queue in queues.items():
+                        if active[host] < self.per_host:
+                            podcast = queue.popleft()
+                            if not queue:
+                                del queues[host]
+                            active[host] += 1
+                            return host, podcast
+                    condition.wait(1)
+                return None, None
+
+        def work():
+            while True:
+                host, podcast = next_podcast()
+                if not podcast:
+                    return
+                try:
+                    fetched = podcast.refresh_feed(context)
+                    queued = podcast.queue_episodes(context.bot, deliver)
+                    with condition:
+                        if fetched:
+                            report.fetched += 1
+                        else:
+                            report.skipped += 1
+                        report.queued += queued
+                except Exception:
+                    logger.exception(f'Failed to refresh {podcast.feed}')
+                    with condition:
+                        report.failed += 1
+                finally:
+                    with condition:
+                        active[host] -= 1
+                        condition.notify_all()
+
+        threads = [threading.Thread(target=work, daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report.deferred = [podcast for queue in queues.values()
+                           for podcast in queue]
+        report.elapsed = time.monotonic() - start
+        logger.info(f'Feeds refreshed: {report}')
+        return report
+
+
+class RefreshScheduler(object):
+    """Keep the next due time of every podcast in a priority queue.
+
+    A podcast is polled about four times per learned publish interval, but
+    not more often than its most eager subscriber asks for with
+    `Setting.feed_freq`, and at least once every `max_interval` seconds.
+    """
+
+    def __init__(self, max_interval=43200, history=10):
+        self.max_interval = max_interval
+        self.history = history
+        self.heap = []  # (due time, podcast id)
+        self.due_at = {}  # podcast id -> due time, outdated heap items are skipped
+
+    def sync(self, now=None):
+        """Add podcasts that are not scheduled yet, they are due at once."""
+        now = time.time() if now is None else now
+        # podcasts with no name are still initialized by subscribe or the importer
+        for podcast_id in Podcast.objects(name__exists=True).scalar('id'):
+            if podcast_id not in self.due_at:
+                self.push(podcast_id, now)
+
+    def push(self, podcast_id, due):
+        self.due_at[podcast_id] = due
+        heapq.heappush(self.heap, (due, podcast_id))
+
+    def pop_due(self, now=None):
+        now = time.time() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due_time, podcast_id = heapq.heappop(self.heap)
+            if self.due_at.get(podcast_id) != due_time:
+                continue
+            del self.due_at[podcast_id]
+            due.append(podcast_id)
+        return due
+
+    def schedule(self, podcast, now=None):
+        now = time.time() if now is None else now
+        self.push(podcast.id, now + self.interval(podcast))
+
+    def interval(self, podcast):
+        published = list(Episode.objects(from_podcast=podcast).order_by(
+            '-published_time').limit(self.history).scalar('published_time'))
+        gaps = [(newer - older).total_seconds()
+                for newer, older in zip(published, published[1:])]
+        interval = median(gaps) / 4 if gaps else self.max_interval
+        freq = podcast.min_feed_freq()
+        if freq is None:
+            return self.max_interval
+        return min(max(interval, freq * 60), self.max_interval)
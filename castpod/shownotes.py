@@ -0,0 +1,109 @@
+import time
+import queue
+import hashlib
+import logging
+import threading
+from telegraph.exceptions import RetryAfterError, TelegraphException, ParsingException
+from .models import Episode, telegraph
+from .projections import podcast_card
+from .broadcast import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class ShownotesPublisher(object):
+    """Publish the shownotes of episodes as Telegraph pages in the background.
+
+    Each episode keeps the path of its page and a hash of what was
+    published, so publishing again is a no-op, and changed shownotes edit
+    the page instead of creating another. Episodes with no hash are the
+    backlog that `sweep` queues, so nothing is lost on a restart.
+    """
+
+    def __init__(self, workers=2, rate=1):
+        self.workers = workers
+        self.bucket = TokenBucket(rate)  # Telegraph calls per second
+        self.queue = queue.Queue()
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def submit(self, episode_ids):
+        with self.lock:
+            if not self.threads:
+                self.threads = [threading.Thread(target=self.work, daemon=True)
+                                for _ in range(self.workers)]
+                for thread in self.threads:
+                    thread.start()
+            for episode_id in episode_ids:
+                if episode_id not in self.queued:
+                    self.queued.add(episode_id)
+                    self.queue.put(episode_id)
+
+    def sweep(self, limit=500):
+        # the latest first, so a backlog of old episodes does not hold up new ones
+        self.submit(list(Episode.objects(shownotes_hash=None).order_by(
+            '-published_time').limit(limit).scalar('id')))
+
+    def work(self):
+        while True:
+            episode_id = self.queue.get()
+            try:
+                self.publish(episode_id)
+            except Exception:
+                logger.exception(f'Failed to publish shownotes of {episode_id}')
+            finally:
+                with self.lock:
+                    self.queued.discard(episode_id)
+
+    def publish(self, episode_id, retry=True):
+        """Publish or update the page of an episode, waiting out flood limits if `retry`."""
+        episode = Episode.objects(id=episode_id).only(
+            'title', 'shownotes', 'from_podcast', '_shownotes_url', 'shownotes_path', 'shownotes_hash'
+        ).no_dereference().first()
+        if not episode:
+            return
+        content = episode.shownotes or ''
+        digest = hashlib.sha1(
+            f'{episode.title}\0{content}'.encode()).hexdigest()
+        if digest == episode.shownotes_hash:
+            return
+        podcast = podcast_card(episode.from_podcast.id)
+        kwargs = {
+            'title': episode.title,
+            'html_content': content or '<p></p>',
+            'author_name': podcast.name if podcast else None
+        }
+        # pages created before paths were stored are edited too
+        path = episode.shownotes_path or (
+            episode._shownotes_url or '').rpartition('telegra.ph/')[2]
+        while True:
+            self.bucket.take()
+            try:
+                if path:
+                    telegraph.edit_page(path, **kwargs)
+                else:
+                    path = telegraph.create_page(**kwargs)['path']
+                break
+            except RetryAfterError as e:
+                if not retry:  # left to the sweep
+                    return
+                time.sleep(e.retry_after)
+            except (TelegraphException, ParsingException) as e:
+                if path and 'ACCESS_DENIED' in str(e):
+                    # a page of another account, e.g. created before the account was stored
+                    path = None
+                    continue
+                # refused by Telegraph or by the local html check, kept until the shownotes change
+                logger.exception(f'Telegraph rejected {episode.title}')
+                Episode.objects(id=episode_id).update_one(
+                    set__shownotes_hash=digest)
+                return
+        Episode.objects(id=episode_id).update_one(
+            set__shownotes_path=path,
+            set__shownotes_hash=digest,
+            set___shownotes_url=f'https://telegra.ph/{path}'
+        )
+
+
+publisher = ShownotesPublisher()
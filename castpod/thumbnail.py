@@ -0,0 +1,75 @@
+import io
+import os
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from PIL import Image
+from . import network
+from .utils import validate_path
+
+THUMB_SIZE = (80, 80)  # telegram asks for < 320*320 and < 200 kB
+
+
+def render(data, path, size=THUMB_SIZE):
+    """Write the artwork in `data` to `path` as a JPEG thumbnail.
+
+    Pillow releases the GIL while it decodes and resizes, so renders in
+    threads run in parallel.
+    """
+    with Image.open(io.BytesIO(data)) as im:
+        # JPEGs are decoded at the smallest scale that still covers `size`
+        im.draft('RGB', (size[0] * 2, size[1] * 2))
+        im = im.convert('RGB')
+        im = im.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        im.save(f'{path}.part', 'JPEG', quality=90)
+    os.replace(f'{path}.part', path)
+    return path
+
+
+class ThumbnailService(object):
+    """Thumbnails of artwork, stored under `root` by the hash of their url.
+
+    Episodes sharing the artwork of their podcast share one file. Artwork is
+    downloaded by `fetchers` threads and resized by `renderers` threads, and
+    concurrent requests for the same url share the same future.
+    """
+
+    def __init__(self, root, fetchers=4, renderers=2):
+        self.root = root
+        self.fetchers = ThreadPoolExecutor(fetchers)
+        self.renderers = ThreadPoolExecutor(renderers)
+        self.lock = threading.Lock()
+        self.pending = {}  # url -> future of its path
+
+    def path_of(self, url):
+        return f"{self.root}/{hashlib.sha1(url.encode()).hexdigest()}.jpeg"
+
+    def submit(self, url):
+        """Return a future of the thumbnail path of `url`, starting the work if needed."""
+        path = self.path_of(url)
+        with self.lock:
+            if url in self.pending:
+                return self.pending[url]
+            if os.path.exists(path):
+                future = Future()
+                future.set_result(path)
+                return future
+            future = self.fetchers.submit(self.make, url, path)
+            self.pending[url] = future
+        future.add_done_callback(lambda _: self.done(url))
+        return future
+
+    def done(self, url):
+        with self.lock:
+            self.pending.pop(url, None)  # failures are retried on next submit
+
+    def make(self, url, path):
+        data = network.get(url, 'artwork').content
+        validate_path(path)
+        return self.renderers.submit(render, data, path).result()
+
+    def path(self, url, timeout=None):
+        return self.submit(url).result(timeout)
+
+
+thumbnails = ThumbnailService('public/logo/thumb')
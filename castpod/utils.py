@@ -1,7 +1,11 @@
 from tqdm.contrib.telegram import tqdm
+from . import network
+from .cache import audio_cache
+from lxml import etree
 import requests
-from bs4 import BeautifulSoup
+import urllib3
 import errno
+import time
 import os
 import re
 from functools import wraps
@@ -17,7 +21,8 @@ endpoints = {
 
 
 def search_itunes(keyword: str):
-    res = requests.get(f"{api_root}{endpoints['search_podcast']}{keyword}")
+    res = network.get(
+        f"{api_root}{endpoints['search_podcast']}{keyword}", 'itunes')
     status = str(res.status_code)
     if not status.startswith('2'):
         return None
@@ -52,45 +57,84 @@ def validate_path(path):
                 raise
 
 
-def download(episode, context) -> str:
-    res = requests.get(episode.url, allow_redirects=True, stream=True)
-    if res.status_code != 200:
-        raise Exception(
-            f"Error when downloading audio, status: {res.status_code}.")
-    block_size = 1024  # 1 Kb
-    if context.user_data:
-        chat_id = context.user_data['chat_id']
-        path = f"public/audio/{context.user_data['podcast']}/{episode.title}.mp3"
-        validate_path(path)
-        total = int(res.headers.get('content-length', 0))
-        progress_bar = tqdm(
-            total=total,
-            unit='iB',
-            token=bot_token,
-            chat_id=chat_id,
-            bar_format='{percentage:3.0f}% |{bar:6}|'
-        )
-        with open(path, 'wb') as f:
-            for data in res.iter_content(block_size):
-                progress_bar.update(len(data))
-                f.write(data)
-            message_id = progress_bar.tgio.message_id
-        context.bot.delete_message(chat_id, message_id)
-        progress_bar.close()
-        if total != 0 and progress_bar.n != total:
-            raise Exception("Error: Something went wrong with progress bar.")
-    else:
-        path = f"public/audio/new/{episode.title}.mp3"
-        validate_path(path)
-        if not os.path.exists(os.path.dirname(path)):
+def audio_path(episode, chat_id=None) -> str:
+    if chat_id:
+        return f"public/audio/{episode.performer}/{episode.title}.mp3"
+    return f"public/audio/new/{episode.title}.mp3"
+
+
+def download(episode, bot, chat_id=None, retries=5) -> str:
+    """Download the audio of `episode`, showing the progress in `chat_id` if given.
+
+    The body is written to a `.part` file first. Interrupted downloads
+    resume from its end with a Range request, in this call or a later one.
+    """
+    path = audio_path(episode, chat_id)
+    if audio_cache.lookup(path, episode.size):  # e.g. when the last upload failed
+        return path
+    validate_path(path)
+    part = f'{path}.part'
+    total = 0
+    progress_bar = None
+    try:
+        for attempt in range(retries):
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
             try:
-                os.makedirs(os.path.dirname(path))
-            except OSError as exc:  # Guard against race condition
-                if exc.errno != errno.EEXIST:
-                    raise
-        with open(path, 'wb') as f:
-            for data in res.iter_content(block_size):
-                f.write(data)
+                with network.get(episode.url, 'audio', headers=headers,
+                                 allow_redirects=True, stream=True) as res:
+                    content_range = res.headers.get('content-range', '')
+                    length = int(content_range.rpartition('/')[2]) if re.match(
+                        r'.+/[0-9]+$', content_range) else 0
+                    if res.status_code == 416:  # nothing left after offset
+                        if offset and offset == length:  # complete already
+                            total = size = length
+                            break
+                        os.remove(part)
+                        continue
+                    elif res.status_code == 206:
+                        total = length
+                        mode = 'ab'
+                    elif res.status_code == 200:  # range not supported, restart
+                        total = int(res.headers.get('content-length', 0))
+                        offset = 0
+                        mode = 'wb'
+                    else:
+                        raise Exception(
+                            f"Error when downloading audio, status: {res.status_code}.")
+                    if chat_id and not progress_bar:
+                        progress_bar = tqdm(
+                            total=total,
+                            initial=offset,
+                            unit='iB',
+                            token=bot_token,
+                            chat_id=chat_id,
+                            bar_format='{percentage:3.0f}% |{bar:6}|'
+                        )
+                    with open(part, mode) as f:
+                        for data in network.iter_adaptive(res, 'audio'):
+                            f.write(data)
+                            if progress_bar:
+                                progress_bar.update(len(data))
+            except (requests.RequestException, urllib3.exceptions.HTTPError):
+                time.sleep(2 ** attempt)
+                continue
+            size = os.path.getsize(part)
+            # fall back to the length in feed when the server does not tell
+            if size >= (total or episode.size or 0):
+                break
+        else:
+            raise Exception(f"Failed to download audio in {retries} attempts.")
+    finally:
+        if progress_bar:
+            bot.delete_message(chat_id, progress_bar.tgio.message_id)
+            progress_bar.close()
+    if total and size != total:
+        os.remove(part)
+        raise Exception(
+            f"Error when downloading audio, got {size} of {total} bytes.")
+    os.replace(part, path)
+    audio_cache.add(path)
     return path
 
 
@@ -103,18 +147,31 @@ def parse_doc(context, user, doc):
                       str(user.user_id), doc['file_name'])
     path = f'public/import/{doc_name}'
     doc_file.download(path)
-    with open(path, 'r') as f:
-        feeds = parse_opml(f)
-        return feeds
+    return iter_opml(path)
+
+
+def iter_opml(path):
+    with open(path, 'rb') as f:
+        yield from parse_opml(f)
 
 
 def parse_opml(f):
-    feeds = []
-    soup = BeautifulSoup(f, 'lxml', from_encoding="utf-8")
-    for podcast in soup.find_all(type="rss"):
-        feeds.append({"name": podcast.attrs.get('text'),
-                      "url": podcast.attrs.get('xmlurl')})
-    return feeds
+    """Yield the rss outlines of an OPML file object as they are read.
+
+    Outlines may be nested at any depth. Malformed markup and bytes that do
+    not match the declared encoding are skipped instead of failing the file.
+    """
+    for event, element in etree.iterparse(f, events=('start', 'end'), tag='outline',
+                                          recover=True, encoding=None, huge_tree=True):
+        if event == 'start':
+            attrs = {key.lower(): value for key, value in element.attrib.items()}
+            if attrs.get('xmlurl') and attrs.get('type', 'rss').lower() == 'rss':
+                yield {"name": attrs.get('text') or attrs.get('title'),
+                       "url": attrs['xmlurl'].strip()}
+        else:  # free what is read, attributes were taken at start
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
 
 # Manage page
 
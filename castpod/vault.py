@@ -0,0 +1,247 @@
+import os
+import uuid
+import queue
+import logging
+import threading
+from telegram import InlineKeyboardMarkup, InlineKeyboardButton, Message, ParseMode
+from config import podcast_vault, manifest, bot_api, bot_token
+from .constants import SPEAKER_MARK
+from .utils import download, audio_path
+from .cache import audio_cache
+from . import network
+
+logger = logging.getLogger(__name__)
+
+
+class MultipartStream(object):
+    """A multipart/form-data body whose last file is read from a streamed response.
+
+    Its length is known in advance, so it is sent with a Content-Length and
+    never holds more than one chunk of the audio in memory.
+    """
+
+    def __init__(self, fields, files, name, filename, res, length):
+        self.boundary = uuid.uuid4().hex
+        head = b''
+        for key, value in fields.items():
+            head += self.part_header(key) + f'{value}\r\n'.encode()
+        for key, (file_name, content) in files.items():
+            head += self.part_header(key, file_name) + content + b'\r\n'
+        self.head = head + self.part_header(name, filename)
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+        self.res = res
+        self.length = length
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def part_header(self, name, filename=None):
+        filename = f'; filename="{filename}"' if filename else ''
+        return (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"{filename}\r\n\r\n'
+        ).encode()
+
+    def __len__(self):
+        return len(self.head) + self.length + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        sent = 0
+        for chunk in network.iter_adaptive(self.res, 'audio'):
+            sent += len(chunk)
+            if sent > self.length:
+                break
+            yield chunk
+        if sent != self.length:  # abort the upload rather than send a broken file
+            raise Exception(
+                f"Error when streaming audio, got {sent} of {self.length} bytes.")
+        yield self.tail
+
+
+def stream_audio(bot, episode, **kwargs):
+    """Pipe the enclosure of `episode` into sendAudio, returns None if its length is unknown."""
+    res = network.get(episode.url, 'audio', allow_redirects=True, stream=True)
+    with res:
+        length = int(res.headers.get('content-length', 0))
+        if res.status_code != 200 or not length or res.headers.get('content-encoding'):
+            return
+        thumb = kwargs.pop('thumb')
+        kwargs['reply_markup'] = kwargs['reply_markup'].to_json()
+        with open(thumb, 'rb') as f:
+            files = {'thumb': ('thumb.jpg', f.read())}
+        body = MultipartStream(kwargs, files, 'audio', 'audio.mp3', res, length)
+        result = network.post(
+            f'{bot_api}{bot_token}/sendAudio', 'upload',
+            data=body,
+            headers={'Content-Type': body.content_type},
+            timeout=(network.CONNECT_TIMEOUT, 600)
+        ).json()
+    if not result.get('ok'):
+        raise Exception(f"Error when streaming audio: {result.get('description')}")
+    return Message.de_json(result['result'], bot)
+
+
+def audio_kwargs(episode, podcast):
+    """Arguments of sendAudio for `episode` in podcast_vault."""
+    number = f"总第 {episode.number} 期\n" if episode.number else ''
+    buttons = [InlineKeyboardButton(
+        '订阅', url=f'https://t.me/{manifest.bot_id}?start=p{podcast.id}')]
+    if episode.shownotes_url or podcast.website:
+        buttons.append(InlineKeyboardButton(
+            '相关链接', url=episode.shownotes_url or podcast.website))
+    return {
+        'chat_id': f'@{podcast_vault}',
+        'caption': (
+            f"{SPEAKER_MARK} *{podcast.name}*\n"
+            f"{number}\n"
+            f"#{podcast.id}"
+        ),
+        'reply_markup': InlineKeyboardMarkup.from_row(buttons),
+        'title': episode.title,
+        'performer': podcast.name,
+        'duration': episode.duration,
+        'thumb': episode.logo.path
+    }
+
+
+class DownloadJob(object):
+    def __init__(self, episode, podcast, chat_id=None):
+        self.episode = episode
+        self.podcast = podcast
+        self.chat_id = chat_id  # where the download progress is shown
+        self.waiters = []
+        self.done = threading.Event()
+        self.stream = None  # pipe the audio from its url at upload, decided at fetch
+        self.audio = None  # path of the downloaded audio otherwise
+        self.message = None  # audio message in podcast_vault, if uploaded by this job
+        self.message_id = None
+        self.error = None
+
+
+class DownloadService(object):
+    """Upload episodes to podcast_vault through a pipeline of worker pools.
+
+    A job goes through the fetch, thumbnail and upload stages, each with its
+    own queue and threads, so the downloads, image work and uploads of
+    different episodes overlap. Concurrent requests for the same episode
+    share one job, every waiter of the job is called with it once the vault
+    message exists.
+    """
+    FETCH, THUMBNAIL, UPLOAD = range(3)
+
+    def __init__(self, fetchers=4, thumbnailers=2, uploaders=2, stream=True):
+        self.stages = [(self.fetch, fetchers), (self.thumbnail,
+                                                thumbnailers), (self.upload, uploaders)]
+        self.queues = [queue.Queue() for _ in self.stages]
+        self.stream = stream
+        self.jobs = {}  # episode id -> job in pipeline
+        self.lock = threading.Lock()
+        self.threads = []
+        self.bot = None
+
+    def request(self, bot, episode, podcast, waiter=None, chat_id=None):
+        with self.lock:
+            self.bot = bot
+            if not self.threads:
+                for stage, (_, workers) in enumerate(self.stages):
+                    self.threads += [threading.Thread(target=self.work, args=(stage,), daemon=True)
+                                     for _ in range(workers)]
+                for thread in self.threads:
+                    thread.start()
+            job = self.jobs.get(episode.id)
+            if not job:
+                job = DownloadJob(episode, podcast, chat_id)
+                self.jobs[episode.id] = job
+                self.queues[self.FETCH].put(job)
+            if waiter:
+                job.waiters.append(waiter)
+        return job
+
+    def pending(self, episode):
+        with self.lock:
+            return episode.id in self.jobs
+
+    def work(self, stage):
+        func = self.stages[stage][0]
+        while True:
+            job = self.queues[stage].get()
+            try:
+                next_stage = func(job)
+            except Exception as e:
+                logger.exception(f'Failed to upload {job.episode.title}')
+                job.error = e
+                next_stage = None
+            if next_stage is None:
+                self.finish(job)
+            else:
+                self.queues[next_stage].put(job)
+
+    def fetch(self, job):
+        job.episode.reload('message_id')
+        if job.episode.message_id:  # uploaded since it was requested
+            job.message_id = job.episode.message_id
+            return
+        path = audio_path(job.episode, job.chat_id)
+        if self.stream and job.stream is None and not os.path.exists(path):
+            res = network.head(job.episode.url, 'audio', allow_redirects=True)
+            # only bodies of known length can be streamed
+            if res.ok and res.headers.get('content-length') and not res.headers.get('content-encoding'):
+                job.stream = True
+                return self.THUMBNAIL
+        job.stream = False
+        job.audio = download(job.episode, self.bot, job.chat_id)
+        return self.THUMBNAIL
+
+    def thumbnail(self, job):
+        job.episode.logo.path
+        return self.UPLOAD
+
+    def upload(self, job):
+        job.episode.reload('_shownotes_url')  # published since it was loaded
+        # the vault message links it for good, but users asking for the episode
+        # do not wait on Telegraph, their upload links the website instead
+        if not job.episode.shownotes_url and not job.chat_id:
+            from .shownotes import publisher  # which imports the models importing this
+            try:
+                publisher.publish(job.episode.id, retry=False)
+                job.episode.reload('_shownotes_url')
+            except Exception:
+                logger.exception(
+                    f'Failed to publish the shownotes of {job.episode.title}')
+        kwargs = audio_kwargs(job.episode, job.podcast)
+        if job.stream:
+            try:
+                job.message = stream_audio(
+                    self.bot, job.episode, parse_mode=ParseMode.MARKDOWN,
+                    disable_notification=True, **kwargs)
+            except Exception:
+                logger.exception(
+                    f'Failed to stream {job.episode.title}, downloading it')
+            if not job.message:
+                job.stream = False
+                return self.FETCH
+        else:
+            job.message = self.bot.send_audio(audio=job.audio, **kwargs)
+            audio_cache.mark_uploaded(job.audio)
+        job.message_id = job.message.message_id
+        job.episode.message_id = job.message.message_id
+        job.episode.file_id = job.message.audio.file_id
+        job.episode.update(
+            set__message_id=job.message.message_id,
+            set__file_id=job.message.audio.file_id
+        )
+
+    def finish(self, job):
+        with self.lock:
+            del self.jobs[job.episode.id]
+        job.done.set()
+        for waiter in job.waiters:
+            try:
+                waiter(job)
+            except Exception:
+                logger.exception('Failed to notify a download waiter')
+
+
+downloader = DownloadService()
@@ -0,0 +1,81 @@
+import time
+import logging
+from pymongo import UpdateOne
+from PIL import Image, UnidentifiedImageError
+from telegram import InputMediaPhoto
+from telegram.error import RetryAfter, TelegramError
+from config import podcast_vault
+from .models import Podcast
+from .thumbnail import thumbnails
+from .cache import podcast_cache
+
+logger = logging.getLogger(__name__)
+
+ALBUM_SIZE = 10  # photos per sendMediaGroup
+RETRY_AFTER = 6 * 3600  # seconds before artwork that failed to load is tried again
+# artwork that cannot be made into a thumbnail however often it is fetched
+BROKEN_ARTWORK = (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError)
+failed = {}  # artwork url -> time it may be tried again
+
+
+def cold_logos(limit):
+    """Podcasts whose logo has no file_id, or one uploaded from other artwork.
+
+    Logos uploaded before file_url was kept are filled in by migrate_logos,
+    so their file_ids are not replaced by thumbnails.
+    """
+    now = time.monotonic()
+    for url in [url for url, until in failed.items() if until <= now]:
+        del failed[url]
+    return Podcast.objects(__raw__={
+        '_logo.url': {'$exists': True, '$ne': None, '$nin': list(failed)},
+        '$or': [{'_logo.file_url': {'$exists': False}},
+                {'$expr': {'$ne': ['$_logo.file_url', '$_logo.url']}}]
+    }).only('_logo').limit(limit)
+
+
+def warm_logos(bot, albums=5):
+    """Upload the thumbnails of up to `albums` albums of cold logos, returns how many are stored.
+
+    Thumbnails are sent to podcast_vault as albums, their file_ids are
+    stored with the url they were made from, and the albums are deleted.
+    """
+    podcasts = list(cold_logos(albums * ALBUM_SIZE))
+    warmed = 0
+    for start in range(0, len(podcasts), ALBUM_SIZE):
+        album = []
+        for podcast in podcasts[start:start+ALBUM_SIZE]:
+            try:
+                with open(thumbnails.path(podcast.logo.url, timeout=60), 'rb') as f:
+                    album.append((podcast, podcast.logo.url, f.read()))
+            except BROKEN_ARTWORK:
+                logger.exception(f'No thumbnail for {podcast.logo.url}')
+                # not retried until the artwork changes, pages keep using the url
+                podcast.update(set___logo__file_url=podcast.logo.url)
+            except Exception:  # e.g. a timeout, tried again later
+                logger.exception(f'Failed to load {podcast.logo.url}')
+                failed[podcast.logo.url] = time.monotonic() + RETRY_AFTER
+        if not album:
+            continue
+        try:
+            if len(album) == 1:  # albums need two photos at least
+                messages = [bot.send_photo(
+                    f'@{podcast_vault}', album[0][2], disable_notification=True)]
+            else:
+                messages = bot.send_media_group(
+                    f'@{podcast_vault}', [InputMediaPhoto(data) for _, _, data in album],
+                    disable_notification=True)
+        except RetryAfter:
+            break  # the rest waits for the next run
+        except TelegramError:
+            logger.exception('Failed to upload logos')
+            continue
+        Podcast._get_collection().bulk_write([UpdateOne(
+            {'_id': podcast.id},
+            {'$set': {'_logo.file_id': message.photo[-1].file_id, '_logo.file_url': url}})
+            for (podcast, url, _), message in zip(album, messages)], ordered=False)
+        podcast_cache.invalidate(*[podcast.id for podcast, _, _ in album])
+        warmed += len(album)
+        for message in messages:
+            bot.delete_message(message.chat_id, message.message_id)
+    return warmed
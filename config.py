@@ -19,6 +19,10 @@ defaults = Defaults(
     disable_notification=True
 )
 
+# Cache
+audio_cache_size = config.getint(
+    'CACHE', 'AUDIO_SIZE', fallback=10 * 1024 ** 3)  # bytes
+
 # Dev
 dev = config['DEV']['USER_ID']
 dev_name = config['DEV']['USER_NAME']